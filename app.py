@@ -1,91 +1,231 @@
+import argparse
+import contextlib
+import os
+import sys
 import numpy as np
-from transaction import TransactionData
+import pandas as pd
+import instrument
+from rules import RuleEngine
+from transaction import PARSERS, TransactionData
 
 
-def process_orders(file_path):
-    # 1. File processing
-    df = TransactionData.parse_csv(file_path)
-    # 2. Basic analysis
+# Figures of the report: name of plot_<name> method and its arguments
+REPORT_FIGURES = [
+    ('tr_activity', {}),
+    ('fund_turnover', {'isin': 'LU98163828108'}),
+    ('activity_increase', {'k': 0.9}),
+    ('dev_factor_act_increase', {}),
+    ('order_amount', {'k': 1}),
+    ('dev_factor_order_amount', {}),
+    ('user_order_amount', {'user': 'user|n4jjtiirlddz2b2lryq8lucl', 'k': 1}),
+    ('activity_increase_user', {'user': 'user|57f4lb88pr59ukwzm8gpp2c5', 'k': 1}),
+]
+
+
+# 2. Basic analysis (all statistics of sections 2 and 3 are computed in one pass)
+def basic_analysis(df, draw=True):
+    summary = df.summary()
         # 2.1. Total number of orders
-    print(f'Number of orders: {len(df)}')
+    print(f'Number of orders: {summary.count}')
         # 2.2. Number of unique clients
-    unq = df['user_id'].nunique()
-    print(f"Number of unique users: {unq}")
+    print(f"Number of unique users: {summary.n_users}")
         # 2.3. Average order amount
-    df['order_amount'] = df['quantity']*df['unit_price']
-    avg_order_amount = df['order_amount'].mean()
+    avg_order_amount = summary.mean
     print(f"Average order amount: {avg_order_amount.round(2)}")
         # 2.4. Average number of orders per day
-    df['date'] = df['created_at'].dt.date
-    tr_per_day = df.groupby(df['date']).size().reset_index(name='number_of_orders')
+    tr_per_day = summary.tr_per_day()
     print(f"Number of transactions per day: \n {tr_per_day}")
-    avg_tr_per_day = tr_per_day['number_of_orders'].mean()
+    avg_tr_per_day = summary.avg_orders_per_day
     avg_dict = {'Average number of orders per day': avg_tr_per_day, 'Rounded up to integer': np.ceil(avg_tr_per_day).astype(int), 'Rounded down to integer': np.floor(avg_tr_per_day).astype(int), 'Rounded up to 3rd decimal':np.ceil(avg_tr_per_day*1000)/1000, 'Rounded down to 3rd decimal':np.floor(avg_tr_per_day*1000)/1000}
     print(avg_dict)
         # 2.5. Bonus
     print(df.info())
-    dup = df[df.duplicated(keep=False)]
+    dup = summary.duplicates
     print(f"Duplicates {dup}")
-    print("Order type has only values: ", df['order_type'].unique())
-    df.get_future_transactions()
-    # 3. Advanced analysis
+    print("Order type has only values: ", summary.order_types.index.tolist())
+
+
+# 3. Advanced analysis
+def advanced_analysis(df, draw=True):
+    summary = df.summary()
         # 3.1. Standart deviation of the order amount
-    print(f"Average order amount: {round(avg_order_amount,2)}")
-    dev_order_amount = df['order_amount'].std()
+    print(f"Average order amount: {round(summary.mean,2)}")
+    dev_order_amount = summary.std
     print(f"Standart deviation of the order amount: {round(dev_order_amount,2)}")
         # 3.2. Total value of orders per client
             # 3.2.1. Turnover
-    client_abs_value = df.groupby(['user_id'])['order_amount'].sum().reset_index(name='turnover')
+    client_abs_value = summary.turnover()
     print(f"Turnover: {client_abs_value}")
             # 3.2.2. Balance (debit - credit)
-    pivot_user = df.pivot_table(index='user_id', columns='order_type', values='order_amount', aggfunc='sum', fill_value=0)
-    pivot_user['balance']=pivot_user['BUY']-pivot_user['SELL']
+    pivot_user = summary.pivot_user()
     print(pivot_user)
         # 3.3. Bonus
             # 3.3.1. Additional info about dataframe
     df.describe()
             # 3.3.2. Seasonal change of total orders value (transaction activity)
-    df.plot_tr_activity()
+    df.plot_tr_activity(draw=draw)
             # 3.3.3. Total value of orders per day
-    per_date = df.groupby('date')['order_amount'].sum().reset_index(name='turnover')
+    per_date = summary.per_date()
     print(per_date)
             # 3.3.4. Total value of orders per fund (balance)
-    pivot_isin = df.pivot_table(index='isin', columns='order_type', values='order_amount', aggfunc='sum', fill_value=0).rename_axis(None, axis=1)
-    pivot_isin['balance']=pivot_isin['BUY']-pivot_isin['SELL']
+    pivot_isin = summary.pivot_isin()
     print(pivot_isin)
-    # 4. Suspicious Transactions
+
+
+# 4. Suspicious Transactions
+def suspicious_transactions(df, draw=True):
         # 4.1. Order value > n
     df.susp_order_amount(9500)
         # 4.2. High frequency orders (threshold in minutes)
     df.get_hf_transactions(180)
         # 4.3. Bonus: Change of the fund's turnover
-    df.plot_fund_turnover('LU98163828108')
-    # 5. Suspicious Transactions (Advanced)
+    df.plot_fund_turnover('LU98163828108', draw=draw)
+
+
+# 5. Suspicious Transactions (Advanced)
+def advanced_suspicious_transactions(df, draw=True):
         # 5.1. Rapid increase in account activity
             # 5.1.1. Change of downtime (pattern)
-    df.plot_activity_increase(0.9)
+    df.plot_activity_increase(0.9, draw=draw)
             # 5.1.2. Suspicious decrease of downtime (rapid increase in activity)
     df.activity_increase_susp(0.845)
             # 5.1.3. How to choose deviation factor (width of the normal range for downtime)
-    df.plot_dev_factor_act_increase()
+    df.plot_dev_factor_act_increase(draw=draw)
         # 5.2. Suspicious value of orders
             # 5.2.1. Change of total value of orders (pattern)
-    df.plot_order_amount(1)
+    df.plot_order_amount(1, draw=draw)
             # 5.2.2. Suspiciously high order amount
     df.order_amount_susp(3)
             # 5.2.3. How to choose deviation factor (width of the normal range for order amount)
-    df.plot_dev_factor_order_amount()
+    df.plot_dev_factor_order_amount(draw=draw)
         # 5.3. Bonus
             # 5.3.1. User's suspicious value of his orders
                 # 5.3.1.1. Order amount of the user with deviation range (pattern)
-    df.plot_user_order_amount('user|n4jjtiirlddz2b2lryq8lucl',1)
+    df.plot_user_order_amount('user|n4jjtiirlddz2b2lryq8lucl',1, draw=draw)
                 # 5.3.1.2. Suspicious order amount for the user
     df.user_order_amount_susp('user|n4jjtiirlddz2b2lryq8lucl',2)
+                # 5.3.1.3. Suspicious order amount for all users
+    df.users_order_amount_susp(2)
                 # 5.3.2. Suspicious circular trading
     df.susp_circ()
                 # 5.3.3. Frequency of transactions for one user
-    df.plot_activity_increase_user('user|57f4lb88pr59ukwzm8gpp2c5', 1)
+    df.plot_activity_increase_user('user|57f4lb88pr59ukwzm8gpp2c5', 1, draw=draw)
+
+
+# Stages of analysis: name (for --only) -> (title of stage, function(df, draw))
+STAGES = {
+    'basic': ('2. Basic analysis', basic_analysis),
+    'advanced': ('3. Advanced analysis', advanced_analysis),
+    'suspicious': ('4. Suspicious Transactions', suspicious_transactions),
+    'advanced_suspicious': ('5. Suspicious Transactions (Advanced)', advanced_suspicious_transactions),
+}
+# All stages: stages of analysis, rule engine (all detectors with thresholds from rules file) and report
+STAGE_NAMES = [*STAGES, 'rules', 'report']
+
+
+# With report_dir plots are not shown, but saved in files of report_dir at the end.
+# Numbered stages are measured when profiling is enabled (TM_PROFILE, see instrument.py)
+# Rows, that don't pass validation, are not analysed and saved in CSV file quarantine (if given) with reasons
+# only - names of stages (STAGE_NAMES) and rules (id of rule, detector or method, e.g. susp_circ, hf), that are run.
+# When only rules are given, the file is parsed and only these rules are run (no analysis and no plots).
+# Returns table of alerts of the rule engine (None if rules were not run), ValueError if file was not parsed.
+def process_orders(file_path, cache_dir=None, report_dir=None, rules_path='rules.json', quarantine=None, only=None, engine='c'):
+    draw = report_dir is None
+    stages = STAGE_NAMES if not only else [name for name in only if name in STAGE_NAMES]
+    selected = [name for name in only or [] if name not in STAGE_NAMES]
+    rule_engine = None
+    if 'rules' in stages or selected:
+        # Rules are read before parsing of the file, so a typo in names doesn't wait for it
+        rule_engine = RuleEngine.from_file(rules_path)
+        if selected:
+            rule_engine = rule_engine.select(selected)
+    # 1. File processing
+    instrument.stage('1. File processing')
+    df = TransactionData.parse_csv(file_path, cache_dir, engine=engine, quarantine=quarantine)
+    if df is None:
+        instrument.end_stage()
+        raise ValueError(f'File {file_path} was not processed')
+    for name, (title, stage) in STAGES.items():
+        if name in stages:
+            instrument.stage(title, len(df))
+            stage(df, draw)
+    alerts = None
+    if rule_engine is not None:
+        # 5.4. All detectors with thresholds from rules.json in one execution plan
+        instrument.stage('5.4. Rules', len(df))
+        alerts = rule_engine.run(df)
+        print(f"Alerts per rule:\n{alerts.groupby('rule_id', sort=False).size()}")
+    # 6. Report
+    if 'report' in stages:
+        instrument.stage('6. Report', len(df))
+        if report_dir is not None:
+            print(df.render_report(REPORT_FIGURES, report_dir))
+    instrument.end_stage()
+    return alerts
+
+
+# Write table of alerts in CSV or JSON (list of records) file, path "-" - standard output
+def write_alerts(alerts, path, fmt='csv'):
+    out = sys.stdout if path == '-' else path
+    if fmt == 'json':
+        alerts.to_json(out, orient='records', date_format='iso', indent=1)
+    else:
+        alerts.to_csv(out, index=False)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Transaction monitoring: analysis of orders and detection of suspicious activity.')
+    parser.add_argument('files', nargs='*', default=['./data/sample_orders_2.csv'], help='CSV files with orders (default: ./data/sample_orders_2.csv)')
+    parser.add_argument('--only', type=lambda value: [name.strip() for name in value.split(',') if name.strip()],
+                        help=f"comma-separated stages ({', '.join(STAGE_NAMES)}) and rules (id, detector or method, e.g. susp_circ,hf); "
+                             'with rules only, just the rule engine runs')
+    parser.add_argument('--rules', default='rules.json', help='file with rules (default: rules.json)')
+    parser.add_argument('--alerts', help='write alerts to this file ("-" for standard output)')
+    parser.add_argument('--format', choices=['csv', 'json'], help='format of alerts (default: from extension of --alerts, csv)')
+    parser.add_argument('--cache-dir', default='./data/.cache', help='cache of parsed files (default: ./data/.cache)')
+    parser.add_argument('--no-cache', dest='cache_dir', action='store_const', const=None, help='parse files without cache')
+    parser.add_argument('--report-dir', help='save plots in this directory instead of showing them')
+    parser.add_argument('--quarantine-dir', help='save rows, that fail validation, in this directory (file with the name of input file)')
+    parser.add_argument('--engine', choices=list(PARSERS), default='c', help='CSV parser (default: c)')
+    args = parser.parse_args(argv)
+    selected = [name for name in args.only or [] if name not in STAGE_NAMES]
+    if args.alerts is not None and args.only and not selected and 'rules' not in args.only:
+        parser.error('--alerts needs rules: add rules stage or names of rules to --only')
+    if selected:
+        try:
+            RuleEngine.from_file(args.rules).select(selected)
+        except ValueError as error:
+            parser.error(str(error))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    fmt = args.format or ('json' if args.alerts and args.alerts.endswith('.json') else 'csv')
+    if args.quarantine_dir is not None:
+        os.makedirs(args.quarantine_dir, exist_ok=True)
+    tables = []
+    failed = []
+    # With alerts in standard output messages of processing go to standard error
+    with contextlib.redirect_stdout(sys.stderr if args.alerts == '-' else sys.stdout):
+        for file_path in args.files:
+            quarantine = None
+            if args.quarantine_dir is not None:
+                quarantine = os.path.join(args.quarantine_dir, os.path.basename(file_path))
+            try:
+                alerts = process_orders(file_path, args.cache_dir, args.report_dir, args.rules, quarantine, args.only, args.engine)
+            except ValueError as error:
+                print(error, file=sys.stderr)
+                failed.append(file_path)
+                continue
+            if alerts is not None:
+                tables.append(alerts.assign(file=file_path))
+    if args.alerts is not None and tables:
+        write_alerts(pd.concat(tables, ignore_index=True), args.alerts, fmt)
+    # Files, that were not parsed, make the run failed (alerts of other files are written)
+    if failed:
+        sys.exit(f"Error: files were not processed: {', '.join(failed)}")
 
 
 if __name__=='__main__':
-    process_orders("./data/sample_orders_2.csv")
+    main()
@@ -0,0 +1,258 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from app import process_orders
+from generate_data import write_orders
+from monitor import TransactionMonitor
+from rules import RuleEngine
+from transaction import DTYPES, PARSERS, TransactionData
+
+
+# Best time of repeat runs of function in seconds
+def best_time(func, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+# Compare memory and groupby time for types guessed by pandas and for declared schema DTYPES
+def compare_schema(file_path, repeat=5):
+    frames = {
+        "inferred": pd.read_csv(file_path, parse_dates=["created_at"]),
+        "schema": pd.read_csv(file_path, parse_dates=["created_at"], dtype=DTYPES),
+    }
+    result = []
+    for name, df in frames.items():
+        df["order_amount"] = df["quantity"] * df["unit_price"]
+        df["date"] = df["created_at"].dt.date
+        # The same groupby as in susp_circ and pivot_table as in app.process_orders
+        groupby_time = best_time(
+            lambda: df.groupby(["user_id", "isin", "date"], observed=True)[
+                "order_type"
+            ].nunique(),
+            repeat,
+        )
+        pivot_time = best_time(
+            lambda: df.pivot_table(
+                index="user_id",
+                columns="order_type",
+                values="order_amount",
+                aggfunc="sum",
+                fill_value=0,
+                observed=True,
+            ),
+            repeat,
+        )
+        result.append(
+            {
+                "dtypes": name,
+                "memory_mb": df.memory_usage(deep=True).sum() / 2**20,
+                "groupby_ms": groupby_time * 1000,
+                "pivot_ms": pivot_time * 1000,
+            }
+        )
+    return pd.DataFrame(result).set_index("dtypes")
+
+
+# Parse throughput in MB/s of the file: previous parser (pandas with guessed format of created_at)
+# and every parser of PARSERS
+def parse_speed(file_paths, repeat=3):
+    parsers = {
+        "guessed_format": lambda path: pd.read_csv(
+            path, parse_dates=["created_at"], dtype=DTYPES
+        ),
+        **PARSERS,
+    }
+    result = []
+    for file_path in file_paths:
+        size_mb = os.path.getsize(file_path) / 2**20
+        for name, parser in parsers.items():
+            seconds = best_time(lambda: parser(file_path), repeat)
+            result.append(
+                {
+                    "file": file_path,
+                    "parser": name,
+                    "size_mb": size_mb,
+                    "seconds": seconds,
+                    "mb_per_second": size_mb / seconds,
+                }
+            )
+    return pd.DataFrame(result).set_index(["file", "parser"])
+
+
+# Replay orders of CSV files through TransactionMonitor one by one and measure orders per second
+def replay_speed(file_paths, repeat=3):
+    result = []
+    for file_path in file_paths:
+        df = TransactionData.parse_csv(file_path)
+        times = []
+        for _ in range(repeat):
+            monitor = TransactionMonitor()
+            start = time.perf_counter()
+            alerts = monitor.replay(df)
+            times.append(time.perf_counter() - start)
+        result.append(
+            {
+                "file": file_path,
+                "orders": len(df),
+                "alerts": len(alerts),
+                "orders_per_second": len(df) / min(times),
+                "us_per_order": min(times) / len(df) * 10**6,
+            }
+        )
+    return pd.DataFrame(result).set_index("file")
+
+
+# Cold start: wall time in seconds (best of repeat runs) of new python process, that only imports modules, and of
+# alert-only runs of app.py (parse file and run selected rules, no analysis and no plots), so startup cost is
+# measured with imports of every library
+def cold_start(file_path, only=("susp_circ", "hf"), repeat=3):
+    commands = {
+        "import pandas": [sys.executable, "-c", "import pandas"],
+        "import app": [sys.executable, "-c", "import app"],
+        "alerts": [
+            sys.executable,
+            "app.py",
+            file_path,
+            "--no-cache",
+            "--only",
+            ",".join(only),
+            "--alerts",
+            os.devnull,
+        ],
+    }
+    result = []
+    for name, command in commands.items():
+        seconds = best_time(
+            lambda: subprocess.run(command, check=True, stdout=subprocess.DEVNULL),
+            repeat,
+        )
+        result.append({"command": name, "seconds": seconds})
+    return pd.DataFrame(result).set_index("command")
+
+
+# Peak memory in MB, allocated by func over memory before the call (allocations of numpy and python objects,
+# traced by tracemalloc, so it is measured in separate run from time)
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+# Cases of benchmark suite: name -> function (df, path of file, directory for report). df is new copy of parsed file for every run,
+# so derived data cached by previous runs is not reused
+SUITE = {
+    "parse_csv": lambda df, path, out: TransactionData.parse_csv(path),
+    "parse_csv_pyarrow": lambda df, path, out: TransactionData.parse_csv(
+        path, engine="pyarrow"
+    ),
+    "get_hf_transactions": lambda df, path, out: df.get_hf_transactions(180),
+    "activity_increase_susp": lambda df, path, out: df.activity_increase_susp(0.845),
+    "susp_circ": lambda df, path, out: df.susp_circ(),
+    "dev_factor_act_increase": lambda df, path, out: df.dev_factor_act_increase(),
+    "dev_factor_order_amount": lambda df, path, out: df.dev_factor_order_amount(),
+    "rules": lambda df, path, out: RuleEngine.from_file().run(df),
+    "process_orders": lambda df, path, out: process_orders(path, report_dir=out),
+}
+
+
+# Synthetic file with rows orders in data_dir, is generated only once for the same rows and seed
+def synthetic_file(rows, data_dir, seed=0):
+    os.makedirs(data_dir, exist_ok=True)
+    file_path = os.path.join(data_dir, f"orders_{rows}_{seed}.csv")
+    if not os.path.exists(file_path):
+        write_orders(
+            file_path + ".tmp", rows, sample="./data/sample_orders_2.csv", seed=seed
+        )
+        os.replace(file_path + ".tmp", file_path)
+    return file_path
+
+
+# Time (best of repeat runs) and peak memory of every case of SUITE on synthetic files of every size.
+# Output of methods is hidden. Returns dictionary with environment and list of results, with out_path
+# it is saved as JSON to compare results between versions.
+def run_suite(
+    sizes=(10**4, 10**5, 10**6),
+    cases=None,
+    repeat=3,
+    data_dir="./data/.bench",
+    out_path=None,
+    seed=0,
+):
+    cases = cases or list(SUITE)
+    results = []
+    for rows in sizes:
+        file_path = synthetic_file(rows, data_dir, seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            base = TransactionData.parse_csv(file_path)
+        with tempfile.TemporaryDirectory() as out_dir:
+            for name in cases:
+                func = SUITE[name]
+                times = []
+                for _ in range(repeat):
+                    df = TransactionData(base.copy())
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        start = time.perf_counter()
+                        func(df, file_path, out_dir)
+                        times.append(time.perf_counter() - start)
+                df = TransactionData(base.copy())
+                with contextlib.redirect_stdout(io.StringIO()):
+                    peak = peak_memory(lambda: func(df, file_path, out_dir))
+                results.append(
+                    {
+                        "case": name,
+                        "rows": len(base),
+                        "seconds": min(times),
+                        "rows_per_second": len(base) / min(times),
+                        "peak_mb": peak,
+                    }
+                )
+    report = {
+        "environment": {
+            "time": pd.Timestamp.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "results": results,
+    }
+    if out_path is not None:
+        with open(out_path, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    # python benchmark.py suite [rows ...] - benchmark suite on synthetic data, results in benchmark.json
+    if len(sys.argv) > 1 and sys.argv[1] == "suite":
+        sizes = [int(float(i)) for i in sys.argv[2:]] or [10**4, 10**5, 10**6]
+        report = run_suite(sizes, out_path="benchmark.json")
+        print(pd.DataFrame(report["results"]).set_index(["rows", "case"]))
+    # python benchmark.py cold [file.csv] - start time of new process for alert-only run of app.py
+    elif len(sys.argv) > 1 and sys.argv[1] == "cold":
+        file_path = sys.argv[2] if len(sys.argv) > 2 else "./data/sample_orders_2.csv"
+        print(cold_start(file_path))
+    else:
+        file_path = sys.argv[1] if len(sys.argv) > 1 else "./data/sample_orders_2.csv"
+        print(compare_schema(file_path))
+        print(parse_speed([file_path]))
+        print(replay_speed([file_path]))
@@ -7,9 +7,10 @@ class TransactionData:
 
     @classmethod
     def from_csv(cls, file):
-        data = pd.read_csv(file, parse_dates=["created_at"])
-        columns = data.columns.tolist()
-        return cls(data.to_dict(orient="records"), columns)
+        data = pd.read_csv(
+            file, parse_dates=["created_at"], date_format="%Y-%m-%d %H:%M:%S"
+        )
+        return cls(data, data.columns.tolist())
 
     def copy(self):
         return TransactionData(self.df.copy(), self.df.columns.tolist())
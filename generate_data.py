@@ -0,0 +1,191 @@
+import sys
+import numpy as np
+import pandas as pd
+from transaction import CHUNKSIZE, FIELDS
+
+HEX = np.array(list("0123456789abcdef"))
+BASE36 = np.array(list("0123456789abcdefghijklmnopqrstuvwxyz"))
+DIGITS = np.array(list("0123456789"))
+
+
+# Array of n random strings: prefix + length random characters of alphabet. Characters are generated as
+# one 2D array and viewed as strings, without loop over rows.
+def random_strings(rng, n, alphabet, length, prefix=""):
+    chars = alphabet[rng.integers(0, len(alphabet), size=(n, length))]
+    strings = chars.view(f"<U{length}").ravel()
+    return np.char.add(prefix, strings) if prefix else strings
+
+
+# Order ids in the same format as in the sample (uuid: 8-4-4-4-12 hex characters)
+def random_order_ids(rng, n):
+    chars = HEX[rng.integers(0, 16, size=(n, 36))]
+    chars[:, [8, 13, 18, 23]] = "-"
+    return chars.view("<U36").ravel()
+
+
+# Generator of synthetic orders with schema and distributions of sample_orders.csv:
+#   users - user ids "user|<24 base36 chars>", activity of users is skewed (lognormal weights),
+#           ~10 orders per user like in the sample
+#   funds - isin "LU<11 digits>", ~150 funds in the sample
+#   ~82% BUY orders, quantity 1-100, unit_price 20-100, created_at uniform over days from start
+# Fraction suspicious of orders belongs to injected patterns, that detectors should find:
+#   large     - order amount far above the usual (susp_order_amount, order_amount_susp)
+#   burst     - several orders of the user within minutes (get_hf_transactions, activity_increase_susp)
+#   circular  - BUY and SELL of the same fund by the same user on the same day (susp_circ)
+#   wash      - SELL of one user and BUY of another user of the same fund, quantity and price within minutes
+# Users and funds of sample file (if given) are added to the generated ones, so methods and app with
+# hard-coded users and funds of the sample work with generated data too.
+class OrderGenerator:
+    def __init__(
+        self,
+        rows,
+        users=None,
+        funds=None,
+        start="2023-01-01",
+        days=365,
+        suspicious=0.01,
+        sample=None,
+        seed=0,
+    ):
+        self.rng = np.random.default_rng(seed)
+        users = users or max(100, rows // 10)
+        funds = funds or max(150, rows // 10000)
+        self.users = random_strings(self.rng, users, BASE36, 24, "user|")
+        self.funds = random_strings(self.rng, funds, DIGITS, 11, "LU")
+        if sample is not None:
+            sample = pd.read_csv(sample, usecols=["user_id", "isin"])
+            self.users = np.union1d(self.users, sample["user_id"].unique())
+            self.funds = np.union1d(self.funds, sample["isin"].unique())
+        weights = self.rng.lognormal(0, 0.8, len(self.users))
+        self.weights = weights / weights.sum()
+        self.start = np.datetime64(pd.Timestamp(start), "s")
+        self.seconds = days * 24 * 3600
+        self.suspicious = suspicious
+
+    def pick_users(self, n):
+        return self.users[self.rng.choice(len(self.users), size=n, p=self.weights)]
+
+    def pick_funds(self, n):
+        return self.funds[self.rng.integers(0, len(self.funds), n)]
+
+    def pick_times(self, n):
+        return self.start + self.rng.integers(0, self.seconds, n)
+
+    def orders(self, created_at, user_id, order_type, isin, quantity, unit_price):
+        return pd.DataFrame(
+            {
+                "created_at": created_at,
+                "user_id": user_id,
+                "order_type": order_type,
+                "order_id": random_order_ids(self.rng, len(created_at)),
+                "isin": isin,
+                "quantity": quantity,
+                "unit_price": np.round(unit_price, 2),
+            }
+        )
+
+    def normal(self, n):
+        return self.orders(
+            self.pick_times(n),
+            self.pick_users(n),
+            np.where(self.rng.random(n) < 0.82, "BUY", "SELL"),
+            self.pick_funds(n),
+            self.rng.integers(1, 101, n),
+            self.rng.uniform(20, 100, n),
+        )
+
+    def large(self, n):
+        df = self.normal(n)
+        df["quantity"] = self.rng.integers(200, 1000, n)
+        return df
+
+    # Bursts of 3-6 orders of one user, next order 1-30 minutes after previous one
+    def burst(self, n):
+        sizes = self.rng.integers(3, 7, max(n // 4, 1))
+        first = self.normal(len(sizes))
+        df = first.loc[np.repeat(first.index, sizes)].reset_index(drop=True)
+        steps = self.rng.integers(60, 30 * 60, len(df))
+        # First order of every burst keeps its time
+        steps[np.cumsum(sizes) - sizes] = 0
+        group = np.repeat(np.arange(len(sizes)), sizes)
+        df["created_at"] += pd.to_timedelta(
+            pd.Series(steps).groupby(group).cumsum(), unit="s"
+        )
+        df["order_id"] = random_order_ids(self.rng, len(df))
+        df["quantity"] = self.rng.integers(1, 101, len(df))
+        return df
+
+    # BUY and SELL of the same fund by the same user within the day of the first order
+    def circular(self, n):
+        buy = self.normal(max(n // 2, 1))
+        buy["order_type"] = "BUY"
+        sell = buy.copy()
+        sell["order_type"] = "SELL"
+        day = buy["created_at"].dt.floor("D")
+        left = (day + pd.Timedelta(days=1) - buy["created_at"]).dt.total_seconds()
+        sell["created_at"] += pd.to_timedelta(
+            (self.rng.random(len(buy)) * (left - 1)).astype("int64"), unit="s"
+        )
+        sell["order_id"] = random_order_ids(self.rng, len(sell))
+        sell["quantity"] += self.rng.integers(-3, 4, len(sell))
+        sell["quantity"] = sell["quantity"].clip(lower=1)
+        sell["unit_price"] = np.round(
+            sell["unit_price"] * self.rng.uniform(0.98, 1.02, len(sell)), 2
+        )
+        return pd.concat([buy, sell], ignore_index=True)
+
+    # SELL of one user and BUY of another user: the same fund and quantity, price within 0.5%, within 10 minutes
+    def wash(self, n):
+        sell = self.normal(max(n // 2, 1))
+        sell["order_type"] = "SELL"
+        buy = sell.copy()
+        buy["order_type"] = "BUY"
+        buy["user_id"] = self.pick_users(len(buy))
+        buy["created_at"] += pd.to_timedelta(
+            self.rng.integers(0, 600, len(buy)), unit="s"
+        )
+        buy["order_id"] = random_order_ids(self.rng, len(buy))
+        buy["unit_price"] = np.round(
+            buy["unit_price"] * self.rng.uniform(0.995, 1.005, len(buy)), 2
+        )
+        return pd.concat([sell, buy], ignore_index=True)
+
+    # Dataframe with about n orders (patterns are generated in groups, so number can differ a little)
+    def chunk(self, n):
+        injected = int(n * self.suspicious)
+        parts = [self.normal(n - injected)]
+        if injected:
+            for pattern in [self.large, self.burst, self.circular, self.wash]:
+                parts.append(pattern(max(injected // 4, 1)))
+        df = pd.concat(parts, ignore_index=True)
+        df = df.iloc[self.rng.permutation(len(df))]
+        return df[FIELDS]
+
+
+# Dataframe with synthetic orders (rows is approximate number of rows)
+def generate_orders(rows, **params):
+    return OrderGenerator(rows, **params).chunk(rows)
+
+
+# Write CSV file with synthetic orders chunk by chunk, so 10^8 rows don't need to fit in memory.
+# Returns number of written rows.
+def write_orders(file_path, rows, chunksize=CHUNKSIZE, **params):
+    generator = OrderGenerator(rows, **params)
+    written = 0
+    with open(file_path, "w", newline="") as f:
+        while written < rows:
+            df = generator.chunk(min(chunksize, rows - written))
+            df.to_csv(f, index=False, header=written == 0)
+            written += len(df)
+    return written
+
+
+if __name__ == "__main__":
+    # python generate_data.py rows file.csv [seed]
+    rows = int(float(sys.argv[1])) if len(sys.argv) > 1 else 10**4
+    file_path = sys.argv[2] if len(sys.argv) > 2 else f"./data/orders_{rows}.csv"
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    written = write_orders(
+        file_path, rows, sample="./data/sample_orders_2.csv", seed=seed
+    )
+    print(f"{written} orders were written to {file_path}")
@@ -0,0 +1,239 @@
+import atexit
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# Opt-in profiling of TransactionData methods and stages of app.process_orders.
+# Is enabled by environment variables (or by enable()):
+#   TM_PROFILE=<file>         - write profile to the file at exit ("1" - profile.json)
+#   TM_PROFILE_FORMAT=chrome  - Chrome trace format (chrome://tracing, Perfetto) instead of list of records
+#   TM_PROFILE_MEMORY=0       - don't trace memory (tracemalloc slows down allocation of python objects)
+# For every call of method and every stage it records wall time, CPU time, peak memory over memory at start
+# and number of rows. When profiling is disabled methods are not wrapped and stage marks return at once,
+# so there is no overhead except one function call per stage.
+
+# Methods, that are called inside other methods many times and are too small to be measured separately
+HELPERS = {
+    "cached",
+    "reset_cache",
+    "feature",
+    "select",
+    "sort_order",
+    "user_index",
+    "user_rows",
+}
+
+# Active profiler, None when profiling is disabled
+profiler = None
+# Classes, whose methods are wrapped when profiling is enabled
+classes = []
+
+
+def rows_of(value):
+    try:
+        return len(value) if hasattr(value, "columns") else None
+    except TypeError:
+        return None
+
+
+# One measured call or stage
+class Span:
+    __slots__ = ("name", "category", "start", "cpu", "memory", "peak", "rows")
+
+    def __init__(self, name, category, memory, rows=None):
+        self.name = name
+        self.category = category
+        self.memory = memory
+        # The highest peak of traced memory of nested spans
+        self.peak = memory
+        self.rows = rows
+        self.start = time.perf_counter()
+        self.cpu = time.process_time()
+
+
+class Profiler:
+    def __init__(self, path=None, fmt="json", memory=True):
+        self.path = path
+        self.fmt = fmt
+        self.memory = memory
+        self.records = []
+        self.stack = []
+        self.stage = None
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    # Traced memory now and its peak since the last reset. Peak is reset, so every span sees peaks after its start
+    def traced(self):
+        if not self.memory:
+            return 0, 0
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for span in self.stack:
+            span.peak = max(span.peak, peak)
+        return current, peak
+
+    def begin(self, name, category, rows=None):
+        with self.lock:
+            current, _ = self.traced()
+            span = Span(name, category, current, rows)
+            self.stack.append(span)
+            return span
+
+    def end(self, span, rows_out=None):
+        wall = time.perf_counter() - span.start
+        cpu = time.process_time() - span.cpu
+        with self.lock:
+            self.traced()
+            if span in self.stack:
+                self.stack.remove(span)
+            self.records.append(
+                {
+                    "name": span.name,
+                    "category": span.category,
+                    "start_ms": (span.start - self.origin) * 1000,
+                    "wall_ms": wall * 1000,
+                    "cpu_ms": cpu * 1000,
+                    "peak_mb": (
+                        (span.peak - span.memory) / 2**20 if self.memory else None
+                    ),
+                    "rows": span.rows,
+                    "rows_out": rows_out,
+                    "depth": len(self.stack),
+                }
+            )
+
+    # Stage of the pipeline: lasts until the next stage or end_stage
+    def start_stage(self, name, rows=None):
+        self.end_stage()
+        self.stage = self.begin(name, "stage", rows)
+
+    def end_stage(self):
+        if self.stage is not None:
+            stage, self.stage = self.stage, None
+            self.end(stage)
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        events = [
+            {
+                "name": record["name"],
+                "cat": record["category"],
+                "ph": "X",
+                "ts": record["start_ms"] * 1000,
+                "dur": record["wall_ms"] * 1000,
+                "pid": pid,
+                "tid": 0,
+                "args": {
+                    key: record[key]
+                    for key in ["cpu_ms", "peak_mb", "rows", "rows_out"]
+                    if record[key] is not None
+                },
+            }
+            for record in self.records
+        ]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, path=None):
+        self.end_stage()
+        path = path or self.path
+        data = self.chrome_trace() if self.fmt == "chrome" else self.records
+        with open(path, "w") as f:
+            json.dump(data, f, indent=1)
+        return path
+
+
+# Method, that measures every call of func, when profiling is enabled
+def measured(func, name):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if profiler is None:
+            return func(*args, **kwargs)
+        rows = rows_of(args[0]) if args else None
+        span = profiler.begin(name, "method", rows)
+        result = None
+        try:
+            result = func(*args, **kwargs)
+            return result
+        finally:
+            profiler.end(span, rows_of(result))
+
+    wrapper.measured = True
+    return wrapper
+
+
+def wrap_methods(cls):
+    for attr, value in list(vars(cls).items()):
+        if attr.startswith("_") or attr in HELPERS:
+            continue
+        kind = type(value)
+        func = value.__func__ if kind in (classmethod, staticmethod) else value
+        # Generators do their work after return, so only creation would be measured
+        if (
+            not inspect.isfunction(func)
+            or getattr(func, "measured", False)
+            or inspect.isgeneratorfunction(func)
+        ):
+            continue
+        wrapper = measured(func, f"{cls.__name__}.{attr}")
+        if kind in (classmethod, staticmethod):
+            wrapper = kind(wrapper)
+        setattr(cls, attr, wrapper)
+
+
+# Register class, its public methods are measured while profiling is enabled
+def instrument_methods(cls):
+    classes.append(cls)
+    if profiler is not None:
+        wrap_methods(cls)
+    return cls
+
+
+def enable(path="profile.json", fmt="json", memory=True):
+    global profiler
+    if profiler is None:
+        profiler = Profiler(path, fmt, memory)
+        for cls in classes:
+            wrap_methods(cls)
+        if path is not None:
+            pid = os.getpid()
+            # Worker processes (run_parallel, render_report) inherit profiler, but only main process saves it
+            atexit.register(
+                lambda: profiler is not None and os.getpid() == pid and profiler.save()
+            )
+    return profiler
+
+
+# Stop profiling, returns profiler with records
+def disable():
+    global profiler
+    stopped, profiler = profiler, None
+    if stopped is not None:
+        stopped.end_stage()
+        if stopped.memory:
+            tracemalloc.stop()
+    return stopped
+
+
+# Mark start of the stage (previous stage ends). Does nothing when profiling is disabled
+def stage(name, rows=None):
+    if profiler is not None:
+        profiler.start_stage(name, rows)
+
+
+def end_stage():
+    if profiler is not None:
+        profiler.end_stage()
+
+
+if os.environ.get("TM_PROFILE"):
+    enable(
+        "profile.json" if os.environ["TM_PROFILE"] == "1" else os.environ["TM_PROFILE"],
+        os.environ.get("TM_PROFILE_FORMAT", "json"),
+        os.environ.get("TM_PROFILE_MEMORY", "1") != "0",
+    )
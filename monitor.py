@@ -0,0 +1,109 @@
+import math
+from transaction import FIELDS
+
+
+# Running count, mean and sum of squared differences from the mean (Welford algorithm)
+class RunningStats:
+    __slots__ = ("count", "mean", "m2")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def std(self):
+        if self.count < 2:
+            return math.nan
+        return math.sqrt(self.m2 / (self.count - 1))
+
+    # How many deviations value is above mean (NaN if there are less than min_count values)
+    def zscore(self, value, min_count=2):
+        if self.count < min_count:
+            return math.nan
+        std = self.std()
+        if not std > 0:
+            return math.nan
+        return (value - self.mean) / std
+
+
+# Real-time monitor with the same rules as detectors of TransactionData:
+#   "order_amount"      - order amount greater than max_amount (susp_order_amount)
+#   "order_amount_dev"  - order amount more than k deviations above average of all orders (order_amount_susp)
+#   "user_amount_dev"   - order amount more than user_k deviations above average of the user (user_order_amount_susp)
+#   "high_frequency"    - downtime after previous order of the user less than min_freq minutes (get_hf_transactions)
+#   "circular"          - user has BUY and SELL of the same fund on the same date (susp_circ)
+# Every order is compared with statistics of previous orders and then added to them.
+# Deviation rules start to work after min_history orders (of all users or of the user).
+# Only running statistics are kept, so every order is processed in O(1).
+class TransactionMonitor:
+    def __init__(self, max_amount=9500, k=3, user_k=2, min_freq=180, min_history=10):
+        self.max_amount = max_amount
+        self.k = k
+        self.user_k = user_k
+        self.min_freq = min_freq
+        self.min_history = min_history
+        self.amounts = RunningStats()
+        # user_id -> running statistics of order amount of the user
+        self.user_amounts = {}
+        # user_id -> time of the last order of the user
+        self.last_order = {}
+        # (user_id, isin) -> (date, set of order types on this date)
+        self.sides = {}
+        self.processed = 0
+
+    # Check one order, returns list of alerts (rule, order_id, user_id, score). Empty list - order is not suspicious.
+    def process(
+        self, created_at, user_id, order_type, order_id, isin, quantity, unit_price
+    ):
+        alerts = []
+        amount = quantity * unit_price
+        if amount > self.max_amount:
+            alerts.append(("order_amount", order_id, user_id, amount))
+        z = self.amounts.zscore(amount, self.min_history)
+        if z > self.k:
+            alerts.append(("order_amount_dev", order_id, user_id, z))
+        self.amounts.add(amount)
+
+        stats = self.user_amounts.get(user_id)
+        if stats is None:
+            stats = self.user_amounts[user_id] = RunningStats()
+        z = stats.zscore(amount, self.min_history)
+        if z > self.user_k:
+            alerts.append(("user_amount_dev", order_id, user_id, z))
+        stats.add(amount)
+
+        last = self.last_order.get(user_id)
+        if last is not None:
+            # Downtime in minutes, orders that came out of order have no downtime
+            downtime = (created_at - last).total_seconds() / 60
+            if 0 < downtime < self.min_freq:
+                alerts.append(("high_frequency", order_id, user_id, downtime))
+        if last is None or created_at > last:
+            self.last_order[user_id] = created_at
+
+        date = created_at.date()
+        day, types = self.sides.get((user_id, isin), (None, None))
+        if day != date:
+            # Only current date is needed, types of previous dates are forgotten
+            types = set()
+            self.sides[(user_id, isin)] = (date, types)
+        types.add(order_type)
+        if len(types) > 1:
+            alerts.append(("circular", order_id, user_id, amount))
+
+        self.processed += 1
+        return alerts
+
+    # Process all orders of dataframe in time order, returns list of all alerts
+    def replay(self, df):
+        alerts = []
+        df = df.sort_values(by="created_at", kind="stable")
+        for row in df[FIELDS].itertuples(index=False, name=None):
+            alerts.extend(self.process(*row))
+        return alerts
@@ -0,0 +1,224 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Drawing of plot_* methods of TransactionData. Every draw_<name> function draws data, computed by
+# plot_<name> method, on matplotlib axes (object-oriented API, without global state of pyplot),
+# so the same function is used to show plot and to save it in the file.
+
+
+# Rows of data to draw on time axis with bounded number of bars: time is split into buckets, one bucket per
+# pixel of axes width, and only rows with minimum and maximum of y in each bucket are kept (plot looks the same).
+# Rows of keep mask (flagged outliers) are kept too. If there are more than max_keep flagged rows,
+# minimum and maximum of flagged rows in each bucket are kept, so every flagged pixel is still drawn.
+# Small data is returned without changes.
+def downsample(ax, data, x, y, keep=None, max_keep=10000):
+    buckets = max(int(ax.bbox.width), 1)
+    if len(data) <= 2 * buckets:
+        return data
+    times = pd.to_datetime(data[x]).to_numpy().astype("int64")
+    span = max(times.max() - times.min(), 1)
+    bucket = ((times - times.min()) / span * (buckets - 1)).astype("int64")
+    values = data[y].to_numpy()
+    rows = bucket_extremes(bucket, values, np.arange(len(data)))
+    if keep is not None:
+        flagged = np.flatnonzero(np.asarray(keep))
+        if len(flagged) > max_keep:
+            flagged = bucket_extremes(bucket, values, flagged)
+        rows = np.union1d(rows, flagged)
+    return data.iloc[np.sort(rows)]
+
+
+# Positions (from rows) of minimum and maximum value in every bucket
+def bucket_extremes(bucket, values, rows):
+    # Sort by bucket and value: first row of each bucket has minimum, last row - maximum
+    order = rows[np.lexsort((values[rows], bucket[rows]))]
+    sorted_bucket = bucket[order]
+    border = sorted_bucket[1:] != sorted_bucket[:-1]
+    return order[np.concatenate([[True], border]) | np.concatenate([border, [True]])]
+
+
+# Bars of y on time axis x. matplotlib creates one object per bar, so when there are more bars than pixels
+# they are drawn as one collection of vertical lines, that looks the same and is drawn much faster.
+def bars(ax, x, y, **kwargs):
+    if len(x) > ax.bbox.width:
+        ax.vlines(x, 0, y, color=kwargs.get("color", "C0"))
+    else:
+        ax.bar(x, y, **kwargs)
+
+
+def draw_tr_activity(ax, data, **params):
+    ax.set_xlabel("Month")
+    ax.set_ylabel("Number of orders")
+    ax.set_title("Seasonal Change of transaction activity")
+    ax.plot(
+        data["created_at_month_str"], data["avg"], color="red", label="Average activity"
+    )
+    ax.plot(
+        data["created_at_month_str"],
+        data["dev_max"],
+        color="yellow",
+        label="Deviation range",
+    )
+    ax.plot(data["created_at_month_str"], data["dev_min"], color="yellow")
+    ax.bar(data["created_at_month_str"], data["orders"])
+    ax.tick_params(axis="x", labelrotation=90)
+    ax.legend()
+
+
+def draw_fund_turnover(ax, data, isin, **params):
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Turnover")
+    ax.set_title(f"Turnover of the fund {isin}")
+    data = downsample(ax, data, "date", "order_amount")
+    bars(ax, data["date"], data["order_amount"], color="m")
+
+
+def draw_activity_increase(ax, data, **params):
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Downtime")
+    ax.set_title("Transaction frequency")
+    data = downsample(
+        ax, data, "created_at", "time_diff", keep=data["time_diff"] < data["dev_min"]
+    )
+    ax.plot(data["created_at"], data["avg"], color="red", label="Average frequency")
+    ax.plot(
+        data["created_at"], data["dev_max"], color="yellow", label="Deviation range"
+    )
+    ax.plot(data["created_at"], data["dev_min"], color="yellow")
+    bars(ax, data["created_at"], data["time_diff"])
+    ax.legend()
+
+
+def draw_dev_factor_act_increase(ax, data, **params):
+    ax.set_xlabel("factor")
+    ax.set_ylabel("%% of suspicious decrease of downtime")
+    ax.set_title("Dependence the suspicious activity increase on deviation factor")
+    ax.plot(data["factor"], data["effect"], color="green")
+
+
+def draw_order_amount(ax, data, **params):
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Total order amount")
+    ax.set_title("Change of total order amount")
+    data = downsample(
+        ax,
+        data,
+        "created_at",
+        "order_amount",
+        keep=data["order_amount"] > data["dev_max"],
+    )
+    bars(ax, data["created_at"], data["order_amount"])
+    ax.plot(data["created_at"], data["avg"], color="red", label="Average order amount")
+    ax.plot(
+        data["created_at"], data["dev_max"], color="yellow", label="Deviation range"
+    )
+    ax.plot(data["created_at"], data["dev_min"], color="yellow")
+    ax.legend()
+
+
+def draw_dev_factor_order_amount(ax, data, **params):
+    ax.set_xlabel("factor")
+    ax.set_ylabel("%% of suspicious orders")
+    ax.set_title("Dependence the suspicious order amount on deviation factor")
+    ax.plot(data["factor"], data["effect"], color="green")
+
+
+def draw_user_order_amount(ax, data, user, **params):
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Order amount")
+    ax.set_title(f"User {user} with his total order amount pattern")
+    data = downsample(
+        ax,
+        data,
+        "created_at",
+        "order_amount",
+        keep=data["order_amount"] > data["dev_max"],
+    )
+    ax.plot(data["created_at"], data["avg"], color="red", label="Average order amount")
+    ax.plot(
+        data["created_at"], data["dev_max"], color="yellow", label="Deviation range"
+    )
+    ax.plot(data["created_at"], data["dev_min"], color="yellow")
+    bars(ax, data["created_at"], data["order_amount"])
+    ax.legend()
+
+
+def draw_activity_increase_user(ax, data, **params):
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Downtime")
+    ax.set_title("Speed of user's activity")
+    keep = (data["time_diff"] < data["dev_min"]) & (data["time_diff"] > 0)
+    data = downsample(ax, data, "created_at", "time_diff", keep=keep)
+    bars(ax, data["created_at"], data["time_diff"])
+    ax.plot(data["created_at"], data["mean"], color="red", label="Average downtime")
+    ax.plot(
+        data["created_at"], data["dev_max"], color="yellow", label="Deviation range"
+    )
+    ax.plot(data["created_at"], data["dev_min"], color="yellow")
+    ax.legend()
+
+
+# Size of figures in inches, None - default size of matplotlib
+FIGSIZE = {
+    "tr_activity": None,
+}
+
+
+def drawer(name):
+    return globals()[f"draw_{name}"]
+
+
+# Show plot in interactive window (or in notebook)
+def show(name, data, **params):
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=FIGSIZE.get(name, (15, 6)))
+    drawer(name)(ax, data, **params)
+    return plt.show()
+
+
+# Draw plot on new figure, that doesn't belong to pyplot, and save it in the file.
+# Format is taken from extension of the file (png, svg, pdf, ...).
+def save(name, data, path, **params):
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=FIGSIZE.get(name, (15, 6)))
+    drawer(name)(fig.subplots(), data, **params)
+    fig.savefig(path)
+    return path
+
+
+# HTML page with all figures of the report
+def write_html(paths, out_dir, title="Transaction monitoring report"):
+    body = "\n".join(
+        f"<h2>{os.path.splitext(os.path.basename(path))[0]}</h2>\n"
+        f'<img src="{os.path.basename(path)}">'
+        for path in paths
+    )
+    html_path = os.path.join(out_dir, "index.html")
+    with open(html_path, "w") as f:
+        f.write(
+            f"<!DOCTYPE html>\n<html>\n<head><title>{title}</title></head>\n"
+            f"<body>\n<h1>{title}</h1>\n{body}\n</body>\n</html>\n"
+        )
+    return html_path
+
+
+# Save figures in parallel worker processes. figures - list of (name, data, params),
+# returns list of paths of saved files in the same order
+def render(figures, out_dir, fmt="png", n_jobs=None, html=True):
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for i, (name, data, params) in enumerate(figures):
+        paths.append(os.path.join(out_dir, f"{i + 1:02d}_{name}.{fmt}"))
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = [
+            executor.submit(save, name, data, path, **params)
+            for (name, data, params), path in zip(figures, paths)
+        ]
+        paths = [future.result() for future in futures]
+    if html:
+        write_html(paths, out_dir)
+    return paths
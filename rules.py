@@ -0,0 +1,210 @@
+import json
+import numpy as np
+import pandas as pd
+from transaction import (
+    both_sides,
+    group_codes,
+    group_stats,
+    hf_links,
+    high_deviation,
+    low_downtimes,
+)
+
+# Rule engine: detectors and their thresholds are declared in config file (rules.json), engine makes plan of
+# shared data (order amount, sort by user and time, downtimes, statistics of users, ...), that is computed once
+# for all rules, and runs every rule as vectorized mask over shared data. Result is one table of alerts.
+# Score shows how far the order is beyond the threshold of the rule (ratio to threshold or number of deviations).
+
+# Shared data of rules: name -> function(df). Is kept in cache of TransactionData, so methods use it too.
+INPUTS = {
+    "order_amount": lambda df: df.feature("order_amount").to_numpy(),
+    # Positions of rows sorted by user and time (the same order as in make_df)
+    "user_order": lambda df: df.sort_order(["user_id", "created_at"]),
+    "downtimes": lambda df: df.make_df()["time_diff"].to_numpy(),
+    "user_codes": lambda df: pd.factorize(df["user_id"])[0],
+    "day_codes": lambda df: df["created_at"]
+    .to_numpy()
+    .astype("datetime64[D]")
+    .astype("int64"),
+}
+
+
+def input_data(df, name):
+    return df.cached(("rule_input", name), lambda: INPUTS[name](df))
+
+
+# Order amount greater than max (susp_order_amount)
+def order_amount(df, data, max):
+    amount = data["order_amount"]
+    rows = np.flatnonzero(amount > max)
+    return rows, amount[rows] / max
+
+
+# Order amount more than k deviations above average of all orders (order_amount_susp)
+def order_amount_dev(df, data, k):
+    amount = data["order_amount"]
+    susp, zscore = high_deviation(amount, amount.mean(), amount.std(ddof=1), k)
+    rows = np.flatnonzero(susp)
+    return rows, zscore[rows]
+
+
+# Order amount more than k deviations above average of orders of the same user (users_order_amount_susp)
+def user_amount_dev(df, data, k):
+    amount = data["order_amount"]
+    avg, dev = group_stats(data["user_codes"], amount)
+    susp, zscore = high_deviation(amount, avg, dev, k)
+    rows = np.flatnonzero(susp)
+    return rows, zscore[rows]
+
+
+# Both orders of every suspicious downtime: the order and the previous order of the user (as methods return them).
+# susp - positions of orders with suspicious downtime in user_order. Order, that is in two suspicious downtimes,
+# is taken once with the higher score
+def downtime_orders(data, susp, scores):
+    rows = np.concatenate([susp, susp - 1])
+    scores = np.concatenate([scores, scores])
+    order = np.lexsort((-scores, rows))
+    rows, scores = rows[order], scores[order]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = rows[1:] != rows[:-1]
+    return data["user_order"][rows[first]], scores[first]
+
+
+# Downtime after previous order of the user less than min_freq minutes (get_hf_transactions)
+def high_frequency(df, data, min_freq):
+    time_diff = data["downtimes"]
+    susp = np.flatnonzero(hf_links(time_diff, min_freq))
+    return downtime_orders(data, susp, min_freq / time_diff[susp])
+
+
+# Downtime more than k deviations below average downtime (activity_increase_susp)
+def activity_increase(df, data, k):
+    mask, score = low_downtimes(data["downtimes"], k)
+    susp = np.flatnonzero(mask)
+    return downtime_orders(data, susp, score[susp])
+
+
+# Orders of user, fund and date, that have both BUY and SELL (susp_circ). Score is order amount
+def circular(df, data):
+    keys = group_codes(data["user_codes"], df["isin"], data["day_codes"])
+    rows = np.flatnonzero(both_sides(keys, (df["order_type"] == "BUY").to_numpy()))
+    return rows, data["order_amount"][rows]
+
+
+# More than max_orders orders or more than max_amount total order amount of the user (or fund) within window
+def velocity(df, data, window="30min", max_orders=None, max_amount=None, by="user_id"):
+    df_window = df.window_counts(window, by)
+    score = np.zeros(len(df_window))
+    if max_orders is not None:
+        score = np.maximum(score, df_window["window_orders"].to_numpy() / max_orders)
+    if max_amount is not None:
+        score = np.maximum(score, df_window["window_amount"].to_numpy() / max_amount)
+    susp = np.flatnonzero(score > 1)
+    return df.sort_order([by, "created_at"])[susp], score[susp]
+
+
+# SELL and BUY of different users with the same fund, quantity and price within window (wash_pairs).
+# Both orders of every pair are alerts, score is number of pairs of the order
+def wash(df, data, window="10min", qty_tol=0, price_tol=0.005):
+    sell, buy = df.wash_matches(window, qty_tol, price_tol)
+    rows, pairs = np.unique(np.concatenate([sell, buy]), return_counts=True)
+    return rows, pairs.astype("float64")
+
+
+# Detectors: name -> (shared data, that detector needs, function(df, data, **params) -> (positions, scores))
+DETECTORS = {
+    "order_amount": (["order_amount"], order_amount),
+    "order_amount_dev": (["order_amount"], order_amount_dev),
+    "user_amount_dev": (["order_amount", "user_codes"], user_amount_dev),
+    "high_frequency": (["user_order", "downtimes"], high_frequency),
+    "activity_increase": (["user_order", "downtimes"], activity_increase),
+    "circular": (["order_amount", "user_codes", "day_codes"], circular),
+    "velocity": ([], velocity),
+    "wash": ([], wash),
+}
+
+# Names of TransactionData methods (and short names), that can be used instead of names of detectors in select
+ALIASES = {
+    "susp_order_amount": "order_amount",
+    "order_amount_susp": "order_amount_dev",
+    "users_order_amount_susp": "user_amount_dev",
+    "get_hf_transactions": "high_frequency",
+    "hf": "high_frequency",
+    "activity_increase_susp": "activity_increase",
+    "susp_circ": "circular",
+    "velocity_susp": "velocity",
+    "wash_pairs": "wash",
+}
+
+
+class RuleEngine:
+    # rules - list of {"id": ..., "detector": name from DETECTORS, "params": {...}}
+    def __init__(self, rules):
+        for rule in rules:
+            if rule["detector"] not in DETECTORS:
+                raise ValueError(
+                    f"Rule '{rule['id']}': unknown detector '{rule['detector']}'"
+                )
+        self.rules = rules
+
+    @classmethod
+    def from_file(cls, path="rules.json"):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    # Engine with rules, that are selected by names: id of rule, name of detector or its alias from ALIASES
+    def select(self, names):
+        names = [ALIASES.get(name, name) for name in names]
+        unknown = [
+            name
+            for name in names
+            if name not in DETECTORS and all(name != rule["id"] for rule in self.rules)
+        ]
+        if unknown:
+            raise ValueError(f"Unknown rules or detectors: {', '.join(unknown)}")
+        return RuleEngine(
+            [
+                rule
+                for rule in self.rules
+                if rule["id"] in names or rule["detector"] in names
+            ]
+        )
+
+    # Plan of execution: shared data in order of first use (each is computed once), then rules
+    def plan(self):
+        inputs = []
+        for rule in self.rules:
+            for name in DETECTORS[rule["detector"]][0]:
+                if name not in inputs:
+                    inputs.append(name)
+        return {"inputs": inputs, "rules": [rule["id"] for rule in self.rules]}
+
+    # Run all rules on TransactionData. Returns table of alerts: rule_id, order_id, user_id, created_at, score
+    def run(self, df):
+        plan = self.plan()
+        data = {name: input_data(df, name) for name in plan["inputs"]}
+        order_id = df["order_id"].to_numpy()
+        user_id = df["user_id"].to_numpy()
+        created_at = df["created_at"].to_numpy()
+        alerts = []
+        for rule in self.rules:
+            func = DETECTORS[rule["detector"]][1]
+            rows, scores = func(df, data, **rule.get("params", {}))
+            order = np.argsort(rows, kind="stable")
+            rows, scores = rows[order], scores[order]
+            alerts.append(
+                pd.DataFrame(
+                    {
+                        "rule_id": rule["id"],
+                        "order_id": order_id[rows],
+                        "user_id": user_id[rows],
+                        "created_at": created_at[rows],
+                        "score": np.asarray(scores, dtype="float64"),
+                    }
+                )
+            )
+        if not alerts:
+            return pd.DataFrame(
+                columns=["rule_id", "order_id", "user_id", "created_at", "score"]
+            )
+        return pd.concat(alerts, ignore_index=True)
@@ -0,0 +1,276 @@
+import glob
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from transaction import CHUNKSIZE, ORDER_TYPES, TransactionData, file_fingerprint
+
+
+# Add aggregates of new data to total aggregates. Only groups of new data are changed.
+def add_aggregate(total, new):
+    total = total.reindex(total.index.union(new.index), fill_value=0)
+    total.loc[new.index] += new
+    return total
+
+
+# Aggregates of one chunk of orders: number of orders and turnover per day,
+# sum of order amount per user and order type, per fund and order type
+def chunk_aggregates(chunk):
+    date = chunk["created_at"].dt.date.rename("date")
+    amount = chunk["quantity"] * chunk["unit_price"]
+    aggregates = {
+        "orders": chunk.groupby(date).size(),
+        "turnover": amount.groupby(date).sum(),
+    }
+    for name in ["user_id", "isin"]:
+        pivot = (
+            amount.groupby([chunk[name], chunk["order_type"]], observed=True)
+            .sum()
+            .unstack(fill_value=0)
+        )
+        pivot.index = pivot.index.astype(object)
+        pivot.columns = pivot.columns.astype(object)
+        aggregates[name] = pivot.reindex(columns=ORDER_TYPES, fill_value=0)
+    return aggregates
+
+
+# Subtract aggregates of removed data from total aggregates. Days, users and funds without orders are removed.
+def subtract_aggregate(total, old):
+    total = total.copy()
+    total.loc[old.index] -= old
+    if total.ndim == 1:
+        return total[total.round(9) != 0]
+    return total[(total.round(9) != 0).any(axis=1)]
+
+
+# Prefix of names of partition files of ingested file: id of its path and hash of its content.
+# Files with the same content have different parts, so removing of one file doesn't touch orders of the other
+def part_prefix(key, content_hash):
+    path_id = hashlib.blake2b(key.encode(), digest_size=4).hexdigest()
+    return f"{path_id}-{content_hash}"
+
+
+# Hashes of order ids. Every date partition keeps sorted hashes of its orders (order_ids.npy) to skip orders,
+# that the store already has
+def order_hashes(order_id):
+    return pd.util.hash_pandas_object(order_id.astype(object), index=False).to_numpy()
+
+
+# Append-only storage of orders on disk. Every ingested CSV file is split by date of orders
+# into partitions (folder date=YYYY-MM-DD with feather files), and aggregates of process_orders
+# (orders and turnover per day, balance per user and per fund) are kept up to date.
+# Ingest of new file reads and writes only new orders, old partitions are not touched.
+# If ingested file was changed, its previous orders are removed (with their aggregates) and the file is ingested again.
+# Orders with order_id, that is already in the partition of their date (e.g. the same order in other file), are skipped.
+# Only order ids of dates of new orders are read, so ingest doesn't depend on size of the store.
+class TransactionStore:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.files_path = os.path.join(path, "files.json")
+        self.aggregates_path = os.path.join(path, "aggregates.pkl")
+        # Fingerprints of ingested files: file path -> fingerprint
+        self.files = {}
+        if os.path.exists(self.files_path):
+            with open(self.files_path) as f:
+                self.files = json.load(f)
+        if os.path.exists(self.aggregates_path):
+            self.aggregates = pd.read_pickle(self.aggregates_path)
+        else:
+            self.aggregates = {
+                "orders": pd.Series(dtype="int64"),
+                "turnover": pd.Series(dtype="float64"),
+                "user_id": pd.DataFrame(columns=ORDER_TYPES, dtype="float64"),
+                "isin": pd.DataFrame(columns=ORDER_TYPES, dtype="float64"),
+            }
+
+    # Add orders of CSV file to the store. The same file is not added twice, changed file replaces its previous orders.
+    # Returns number of added orders.
+    def ingest(self, file_path, chunksize=CHUNKSIZE):
+        from pyarrow import feather
+
+        key = os.path.abspath(file_path)
+        fingerprint = file_fingerprint(file_path, self.files.get(key))
+        if key in self.files and self.files[key]["hash"] == fingerprint["hash"]:
+            print("File was already ingested.")
+            return 0
+        if fingerprint["hash"] is None:
+            fingerprint = file_fingerprint(file_path)
+        if key in self.files:
+            self.remove(key)
+        added = 0
+        # date -> sorted hashes of order ids of the date, only dates of new orders are read
+        ids = {}
+        for i, chunk in enumerate(
+            TransactionData.parse_csv_chunks(file_path, chunksize)
+        ):
+            chunk = pd.DataFrame(chunk)
+            date = chunk["created_at"].dt.strftime("%Y-%m-%d")
+            new_parts = []
+            for day, part in chunk.groupby(date):
+                hashes = order_hashes(part["order_id"])
+                known = self.date_ids(day, ids)
+                is_new = ~np.isin(hashes, known)
+                if not is_new.any():
+                    continue
+                part = part[is_new]
+                ids[day] = np.union1d(known, hashes[is_new])
+                new_parts.append(part)
+                part_dir = os.path.join(self.path, f"date={day}")
+                os.makedirs(part_dir, exist_ok=True)
+                # Name depends on file and its content, so repeated ingest after failure overwrites the same part
+                part_path = os.path.join(
+                    part_dir, f"{part_prefix(key, fingerprint['hash'])}-{i}.feather"
+                )
+                feather.write_feather(
+                    part.reset_index(drop=True), part_path, compression="uncompressed"
+                )
+            if not new_parts:
+                continue
+            chunk = pd.concat(new_parts)
+            for name, new in chunk_aggregates(chunk).items():
+                self.aggregates[name] = add_aggregate(self.aggregates[name], new)
+            added += len(chunk)
+        self.save_ids(ids)
+        self.files[key] = fingerprint
+        self.save()
+        return added
+
+    # Sorted hashes of order ids of the date (ids - already read dates)
+    def date_ids(self, day, ids):
+        if day not in ids:
+            part_dir = os.path.join(self.path, f"date={day}")
+            ids_path = os.path.join(part_dir, "order_ids.npy")
+            if os.path.exists(ids_path):
+                ids[day] = np.load(ids_path)
+            else:
+                # Partition of older version of the store (or new date): hashes are collected from its parts
+                ids[day] = np.unique(
+                    np.concatenate(
+                        [np.array([], dtype="uint64")]
+                        + [
+                            order_hashes(part["order_id"])
+                            for part in self.parts(day, day)
+                        ]
+                    )
+                )
+        return ids[day]
+
+    # Write order ids of changed dates. Dates without orders have no partition
+    def save_ids(self, ids):
+        for day, hashes in ids.items():
+            part_dir = os.path.join(self.path, f"date={day}")
+            if not os.path.isdir(part_dir):
+                continue
+            ids_path = os.path.join(part_dir, "order_ids.npy")
+            np.save(ids_path + ".tmp.npy", hashes)
+            os.replace(ids_path + ".tmp.npy", ids_path)
+
+    # Remove orders of ingested file (its partitions, aggregates and order ids). Returns number of removed orders.
+    def remove(self, key):
+        from pyarrow import feather
+
+        removed = 0
+        content_hash = self.files[key]["hash"]
+        part_paths = glob.glob(
+            os.path.join(
+                self.path, "date=*", f"{part_prefix(key, content_hash)}-*.feather"
+            )
+        )
+        # Parts of older version of the store are named only by hash of content, they are removed,
+        # if no other ingested file has the same content
+        if all(
+            other == key or fingerprint["hash"] != content_hash
+            for other, fingerprint in self.files.items()
+        ):
+            part_paths += glob.glob(
+                os.path.join(self.path, "date=*", f"{content_hash}-*.feather")
+            )
+        ids = {}
+        for part_path in part_paths:
+            part = feather.read_table(part_path).to_pandas()
+            for name, old in chunk_aggregates(part).items():
+                self.aggregates[name] = subtract_aggregate(self.aggregates[name], old)
+            part_dir = os.path.dirname(part_path)
+            day = os.path.basename(part_dir)[len("date=") :]
+            known = self.date_ids(day, ids)
+            ids[day] = np.setdiff1d(
+                known, order_hashes(part["order_id"]), assume_unique=True
+            )
+            removed += len(part)
+            os.remove(part_path)
+            if not any(name.endswith(".feather") for name in os.listdir(part_dir)):
+                for name in os.listdir(part_dir):
+                    os.remove(os.path.join(part_dir, name))
+                os.rmdir(part_dir)
+        self.save_ids(ids)
+        del self.files[key]
+        return removed
+
+    def save(self):
+        pd.to_pickle(self.aggregates, self.aggregates_path + ".tmp")
+        os.replace(self.aggregates_path + ".tmp", self.aggregates_path)
+        with open(self.files_path + ".tmp", "w") as f:
+            json.dump(self.files, f)
+        os.replace(self.files_path + ".tmp", self.files_path)
+
+    # Dates of partitions in the store
+    def dates(self):
+        return sorted(
+            name[len("date=") :]
+            for name in os.listdir(self.path)
+            if name.startswith("date=")
+        )
+
+    # Dataframes of partitions from start to end date (including), all partitions by default
+    def parts(self, start=None, end=None):
+        from pyarrow import feather
+
+        for day in self.dates():
+            if start is not None and day < str(pd.Timestamp(start).date()):
+                continue
+            if end is not None and day > str(pd.Timestamp(end).date()):
+                continue
+            part_dir = os.path.join(self.path, f"date={day}")
+            for name in sorted(os.listdir(part_dir)):
+                if not name.endswith(".feather"):
+                    continue
+                yield feather.read_table(
+                    os.path.join(part_dir, name), memory_map=True
+                ).to_pandas()
+
+    # TransactionData with orders from start to end date (including), all orders by default
+    def load(self, start=None, end=None):
+        parts = list(self.parts(start, end))
+        if not parts:
+            return None
+        df = pd.concat(parts, ignore_index=True)
+        df = df.sort_values(by="created_at", kind="stable", ignore_index=True)
+        return TransactionData(df.astype({"user_id": "category", "isin": "category"}))
+
+    # Number of orders per day (tr_per_day in process_orders)
+    def tr_per_day(self):
+        return (
+            self.aggregates["orders"]
+            .rename_axis("date")
+            .reset_index(name="number_of_orders")
+        )
+
+    # Total value of orders per day (per_date in process_orders)
+    def per_date(self):
+        return (
+            self.aggregates["turnover"].rename_axis("date").reset_index(name="turnover")
+        )
+
+    # Balance (debit - credit) per user (pivot_user in process_orders)
+    def pivot_user(self):
+        pivot = self.aggregates["user_id"].rename_axis("user_id").copy()
+        pivot["balance"] = pivot["BUY"] - pivot["SELL"]
+        return pivot
+
+    # Balance (debit - credit) per fund (pivot_isin in process_orders)
+    def pivot_isin(self):
+        pivot = self.aggregates["isin"].rename_axis(None).copy()
+        pivot["balance"] = pivot["BUY"] - pivot["SELL"]
+        return pivot
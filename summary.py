@@ -0,0 +1,203 @@
+import numpy as np
+import pandas as pd
+from transaction import FIELDS, ORDER_TYPES
+
+
+# Sums of values per key and order type: table with keys in index and BUY, SELL columns.
+# Only keys that have orders are included.
+def side_sums(keys, side_codes, sides, values):
+    key_codes, uniques = pd.factorize(keys, sort=True)
+    n = len(uniques)
+    sums = np.bincount(
+        key_codes * len(sides) + side_codes, weights=values, minlength=n * len(sides)
+    ).reshape(n, len(sides))
+    table = pd.DataFrame(sums, index=pd.Index(np.asarray(uniques, dtype=object)))
+    table.columns = list(sides)
+    return table.reindex(columns=ORDER_TYPES, fill_value=0.0)
+
+
+# Add two tables or series of sums, keys of both are kept
+def add_sums(left, right):
+    return left.add(right, fill_value=0).sort_index()
+
+
+# Summary of orders (basic and advanced analysis of process_orders), computed in one pass over the data:
+# order amount, codes of users, funds, order types and days are found once and all sums are counted by bincount.
+# Everything is kept as partial aggregates (counts, sums, sum of squared differences from the mean), so summaries
+# of chunks, files or partitions are combined with merge (or +) into the same summary as of all data at once.
+class OrderSummary:
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        # Sum of squared differences of order amount from the mean
+        self.m2 = 0.0
+        # date -> number of orders, date -> total order amount
+        self.orders_per_day = pd.Series(dtype="int64")
+        self.turnover_per_day = pd.Series(dtype="float64")
+        # Sum of order amount per user and per fund, columns BUY and SELL
+        self.users = pd.DataFrame(columns=ORDER_TYPES, dtype="float64")
+        self.funds = pd.DataFrame(columns=ORDER_TYPES, dtype="float64")
+        # order type -> number of orders
+        self.order_types = pd.Series(dtype="int64")
+        # Sorted unique hashes of rows and hash -> number of rows for hashes of duplicated rows
+        self.hashes = np.array([], dtype="uint64")
+        self.duplicate_counts = pd.Series(dtype="int64")
+        # Duplicated rows. Rows of different parts, that duplicate each other, are only counted in n_duplicates
+        self.duplicates = pd.DataFrame(columns=FIELDS)
+        self.first = None
+        self.last = None
+        # Number of orders with created_at in the future (at the moment of computing)
+        self.future = 0
+
+    # Summary of dataframe with columns of the file
+    @classmethod
+    def from_frame(cls, df):
+        summary = cls()
+        if len(df) == 0:
+            return summary
+        amount = (df["quantity"] * df["unit_price"]).to_numpy(dtype="float64")
+        summary.count = len(amount)
+        summary.mean = amount.mean()
+        summary.m2 = ((amount - summary.mean) ** 2).sum()
+
+        side_codes, sides = pd.factorize(df["order_type"])
+        summary.order_types = pd.Series(
+            np.bincount(side_codes, minlength=len(sides)),
+            index=pd.Index(np.asarray(sides, dtype=object)),
+        )
+        summary.users = side_sums(df["user_id"], side_codes, sides, amount)
+        summary.funds = side_sums(df["isin"], side_codes, sides, amount)
+
+        # Days as offsets from the first day, so orders and turnover per day are counted by bincount
+        created_at = df["created_at"].to_numpy(dtype="datetime64[ns]")
+        days = created_at.astype("datetime64[D]")
+        offsets = (days - days.min()).astype("int64")
+        counts = np.bincount(offsets)
+        present = np.flatnonzero(counts)
+        dates = pd.Index((days.min() + present).astype(object), name="date")
+        summary.orders_per_day = pd.Series(counts[present], index=dates)
+        summary.turnover_per_day = pd.Series(
+            np.bincount(offsets, weights=amount)[present], index=dates
+        )
+
+        summary.first = pd.Timestamp(created_at.min())
+        summary.last = pd.Timestamp(created_at.max())
+        summary.future = int((created_at > np.datetime64(pd.Timestamp.now())).sum())
+
+        # Rows with the same values in all columns of the file are duplicates
+        hashes = pd.util.hash_pandas_object(df[FIELDS], index=False).to_numpy()
+        summary.hashes, counts = np.unique(hashes, return_counts=True)
+        summary.duplicate_counts = pd.Series(
+            counts[counts > 1], index=summary.hashes[counts > 1]
+        )
+        if len(summary.duplicate_counts):
+            summary.duplicates = df[np.isin(hashes, summary.duplicate_counts.index)][
+                FIELDS
+            ]
+        return summary
+
+    # Summary of data of both summaries
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            return other
+        merged = OrderSummary()
+        merged.count = self.count + other.count
+        # Combine statistics of two parts (parallel variance algorithm)
+        delta = other.mean - self.mean
+        merged.mean = self.mean + delta * other.count / merged.count
+        merged.m2 = (
+            self.m2 + other.m2 + delta**2 * self.count * other.count / merged.count
+        )
+        merged.orders_per_day = add_sums(self.orders_per_day, other.orders_per_day)
+        merged.turnover_per_day = add_sums(
+            self.turnover_per_day, other.turnover_per_day
+        )
+        merged.users = add_sums(self.users, other.users)
+        merged.funds = add_sums(self.funds, other.funds)
+        merged.order_types = add_sums(self.order_types, other.order_types)
+
+        # Number of rows of every hash, that is duplicated in any part or found in both parts
+        common = np.intersect1d(self.hashes, other.hashes, assume_unique=True)
+        keys = np.union1d(
+            common,
+            np.union1d(self.duplicate_counts.index, other.duplicate_counts.index),
+        ).astype("uint64")
+        rows = self.hash_counts(keys) + other.hash_counts(keys)
+        merged.hashes = np.union1d(self.hashes, other.hashes)
+        merged.duplicate_counts = pd.Series(rows[rows > 1], index=keys[rows > 1])
+        parts = [part for part in [self.duplicates, other.duplicates] if len(part)]
+        if parts:
+            merged.duplicates = pd.concat(parts)
+
+        merged.first = min(self.first, other.first)
+        merged.last = max(self.last, other.last)
+        merged.future = self.future + other.future
+        return merged
+
+    def __add__(self, other):
+        return self.merge(other)
+
+    # Summary of all summaries (e.g. of chunks, files or partitions)
+    @classmethod
+    def combine(cls, summaries):
+        total = cls()
+        for summary in summaries:
+            total = total.merge(summary)
+        return total
+
+    # Number of rows with every hash of keys in this part
+    def hash_counts(self, keys):
+        present = np.isin(keys, self.hashes).astype("int64")
+        known = self.duplicate_counts.reindex(keys).to_numpy()
+        return np.where(np.isnan(known), present, known).astype("int64")
+
+    @property
+    def n_users(self):
+        return len(self.users)
+
+    # Number of rows, that have at least one duplicate (as df.duplicated(keep=False))
+    @property
+    def n_duplicates(self):
+        return int(self.duplicate_counts.sum())
+
+    @property
+    def std(self):
+        if self.count < 2:
+            return np.nan
+        return (self.m2 / (self.count - 1)) ** 0.5
+
+    @property
+    def avg_orders_per_day(self):
+        return self.orders_per_day.mean()
+
+    # Number of orders per day
+    def tr_per_day(self):
+        return self.orders_per_day.rename_axis("date").reset_index(
+            name="number_of_orders"
+        )
+
+    # Total value of orders per day
+    def per_date(self):
+        return self.turnover_per_day.rename_axis("date").reset_index(name="turnover")
+
+    # Total value of orders per user
+    def turnover(self):
+        return (
+            self.users.sum(axis=1).rename_axis("user_id").reset_index(name="turnover")
+        )
+
+    # Balance (debit - credit) per user
+    def pivot_user(self):
+        pivot = (
+            self.users.rename_axis("user_id").rename_axis("order_type", axis=1).copy()
+        )
+        pivot["balance"] = pivot["BUY"] - pivot["SELL"]
+        return pivot
+
+    # Balance (debit - credit) per fund
+    def pivot_isin(self):
+        pivot = self.funds.rename_axis("isin").copy()
+        pivot["balance"] = pivot["BUY"] - pivot["SELL"]
+        return pivot
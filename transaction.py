@@ -1,43 +1,676 @@
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+import instrument
+
+# Columns of the CSV file in order of the file
+FIELDS = [
+    "created_at",
+    "user_id",
+    "order_type",
+    "order_id",
+    "isin",
+    "quantity",
+    "unit_price",
+]
+# Set of column names expected in the CSV file
+COLUMNS = set(FIELDS)
+# Known order types (values of order_type)
+ORDER_TYPES = ["BUY", "SELL"]
+# Types of columns. Repeated strings are stored as categories (dictionary of unique values + integer codes),
+# order_type has only two known values. created_at is parsed separately as date-time.
+DTYPES = {
+    "user_id": "category",
+    "order_type": pd.CategoricalDtype(ORDER_TYPES),
+    "order_id": "object",
+    "isin": "category",
+    "quantity": "int32",
+    "unit_price": "float64",
+}
+# Types of columns while reading, before rows are validated: order_type can have unknown values and quantity
+# can be missing, these rows are moved to quarantine (see validate_rows) and the rest is converted to DTYPES
+RAW_DTYPES = {**DTYPES, "order_type": "category", "quantity": "float64"}
+# The same, but numeric columns are read as text (file has text in them), see to_numbers
+TEXT_DTYPES = {**RAW_DTYPES, "quantity": "object", "unit_price": "object"}
+# Default number of rows in one chunk for streaming mode
+CHUNKSIZE = 100000
+# Format of created_at in the files. Known format is decoded without guessing it from values
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+# Columns, that are derived from columns of the file
+FEATURES = {
+    "order_amount": lambda df: df["quantity"] * df["unit_price"],
+    "date": lambda df: df["created_at"].dt.date,
+}
+
+
+# Curve "% of suspicious transactions vs deviation factor" for all factors in one pass.
+# Deviations from average are sorted once and number of suspicious values for each factor is found by binary search.
+# side "above": value - avg > factor * std, side "below": value - avg < -factor * std. Returns arrays (factors, effect).
+def dev_factor_sweep(values, factors, total, side="above"):
+    values = pd.Series(values, dtype="float64")
+    avg = values.mean()
+    std = values.std()
+    deviation = np.sort((values - avg).to_numpy())
+    factors = np.asarray(factors, dtype="float64")
+    if side not in ("above", "below"):
+        raise ValueError("side must be 'above' or 'below' only")
+    # Deviation is unknown (less than two values): comparisons with NaN are False, nothing is suspicious
+    if not np.isfinite(std):
+        return factors, np.zeros(len(factors))
+    if side == "above":
+        counts = len(deviation) - np.searchsorted(
+            deviation, factors * std, side="right"
+        )
+    elif side == "below":
+        counts = np.searchsorted(deviation, 0 - factors * std, side="left")
+    return factors, counts * 100 / total
+
+
+# Baseline for every row: average and deviation of values of previous rows of the same group in time window
+# (e.g. "30D"), current row is not included. Rows must be sorted by keys and times. With halflife (number of
+# orders) average and deviation are exponentially weighted over all previous rows of the group instead.
+# NaN values are skipped. Returns arrays (avg, dev), NaN where there are less than min_periods previous values.
+def rolling_stats(keys, times, values, window="30D", halflife=None, min_periods=2):
+    df = pd.DataFrame({"key": keys, "created_at": times, "value": values})
+    grouped = df.groupby("key", observed=True, sort=False)
+    if halflife is None:
+        rolling = grouped.rolling(
+            window, on="created_at", closed="left", min_periods=min_periods
+        )["value"]
+    else:
+        # Value of previous row, so current row is not included in its baseline
+        previous = grouped["value"].shift(1)
+        rolling = previous.groupby(df["key"], observed=True, sort=False).ewm(
+            halflife=halflife, min_periods=min_periods
+        )
+    # Groups keep order of sorted rows, so results are in the same order as rows
+    return rolling.mean().to_numpy(), rolling.std().to_numpy()
+
+
+# Short downtimes: mask of transactions, that happened less than min_freq minutes after previous transaction
+# of the same user. Downtime 0 means first transaction of the user (or the same time), it's not suspicious.
+def hf_links(time_diff, min_freq):
+    return (time_diff > 0) & (time_diff < min_freq)
+
+
+# Masks and scores of detectors: methods of TransactionData and rules of the rule engine (rules.py) call the same functions.
+
+
+# Values more than k deviations above average: avg and dev are numbers or arrays (of every row).
+# Returns (mask, zscore - number of deviations between value and average). NaN deviation flags nothing.
+def high_deviation(values, avg, dev, k):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        zscore = (values - avg) / dev
+    return (values - avg) > k * dev, zscore
+
+
+# Average and deviation of values of the group of every row (codes - integer codes of groups)
+def group_stats(codes, values):
+    stats = pd.Series(values).groupby(codes).agg(["mean", "std"])
+    return stats["mean"].to_numpy()[codes], stats["std"].to_numpy()[codes]
+
+
+# Downtimes more than k deviations below average of positive downtimes (rapid increase in activity).
+# Returns (mask, number of deviations between average and downtime)
+def low_downtimes(time_diff, k):
+    positive = pd.Series(time_diff[time_diff > 0], dtype="float64")
+    avg = positive.mean()
+    dev = positive.std()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        score = (avg - time_diff) / dev
+    return (time_diff > 0) & (time_diff < avg - k * dev), score
+
+
+# Circular trading: mask of rows of groups (e.g. user, fund and date), that have both BUY and SELL orders.
+# keys - integer codes of groups, is_buy - mask of BUY orders
+def both_sides(keys, is_buy):
+    buys = np.bincount(keys, weights=is_buy.astype("float64"))
+    both = (buys > 0) & (buys < np.bincount(keys))
+    return both[keys]
+
+
+# Number of rows and sum of values in time window (t - window, t] of every row among rows with the same key
+# (rows with the same time are in the window of each other). Rows must be sorted by keys and times, keys are
+# increasing integer codes, times and window - int64. Start of window of every row is found by binary search over
+# key and rank of time (vectorized two pointers), sums are differences of cumulative sum, so time is O(N log N).
+def window_totals(keys, times, values, window):
+    all_times = np.unique(times)
+    size = len(all_times) + 1
+    comp = keys * size + np.searchsorted(all_times, times)
+    lo = keys * size + np.searchsorted(all_times, times - window, "right")
+    start = np.searchsorted(comp, lo, "left")
+    end = np.searchsorted(comp, comp, "right")
+    cumsum = np.concatenate([[0.0], np.cumsum(values)])
+    return end - start, cumsum[end] - cumsum[start]
+
+
+# Integer code of every row for combination of values in columns (like groupby keys)
+def group_codes(*columns):
+    codes = None
+    for col in columns:
+        col_codes, uniques = pd.factorize(col)
+        if codes is None:
+            codes = col_codes
+        else:
+            codes = pd.factorize(codes * len(uniques) + col_codes)[0]
+    return codes
+
+
+# Pairs of rows from left and right with the same key and time difference not more than window.
+# Right rows are sorted once by key and time, then for all left rows borders of their window are found
+# by binary search, so time is O(N log N + number of pairs) instead of merge of every row with every row.
+# keys - integer codes (the same codes for left and right), times - int64. Returns positions (left, right).
+def window_pairs(left_keys, left_times, right_keys, right_times, window):
+    # Times are replaced by their rank among all times, so key and time fit in one int64 number
+    all_times = np.unique(np.concatenate([left_times, right_times]))
+    size = len(all_times) + 1
+    right_comp = right_keys * size + np.searchsorted(all_times, right_times)
+    right_order = np.argsort(right_comp, kind="stable")
+    right_comp = right_comp[right_order]
+    lo = left_keys * size + np.searchsorted(all_times, left_times - window, "left")
+    hi = left_keys * size + np.searchsorted(all_times, left_times + window, "right")
+    start = np.searchsorted(right_comp, lo, "left")
+    counts = np.searchsorted(right_comp, hi, "left") - start
+    # Expand ranges [start, start + count) into positions
+    left_pos = np.repeat(np.arange(len(left_keys)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    right_pos = right_order[np.repeat(start, counts) + offsets]
+    return left_pos, right_pos
+
+
+# Detectors, that look at every user separately, with columns to sort merged results of parts by
+USER_DETECTORS = {
+    "make_df": ["user_id", "created_at"],
+    "get_hf_transactions": ["user_id", "created_at"],
+    "hf_episodes": ["min_freq", "user_id", "start"],
+    "users_order_amount_susp": ["user_id", "created_at"],
+    "susp_circ": ["user_id", "isin", "date", "order_type"],
+    "circ_pairs": ["user_id", "isin", "buy_created_at", "sell_created_at"],
+}
+
+
+# Run detectors on one part of dataset, saved in feather file. Is called in worker process of run_parallel
+def run_partition(path, detectors):
+    from pyarrow import feather
+
+    df = feather.read_table(path, memory_map=True).to_pandas()
+    # Restore original row labels
+    df = TransactionData(df.set_index("index").rename_axis(None))
+    return {name: getattr(df, name)(*args) for name, args in detectors.items()}
+
+
+# Column created_at: values in TIME_FORMAT are decoded directly, other formats (e.g. without seconds) are guessed
+# and values, that are not date-time, become NaT
+def parse_times(values):
+    try:
+        return pd.to_datetime(values, format=TIME_FORMAT)
+    except (ValueError, TypeError):
+        return pd.to_datetime(values, format="mixed", errors="coerce")
+
+
+# Numeric columns read as text: values, that are not numbers, become NaN
+def to_numbers(df):
+    for col in ["quantity", "unit_price"]:
+        if col in df and df[col].dtype == object:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    return df
+
+
+# Parser of pandas (C engine, one thread)
+def read_csv_c(file_path):
+    try:
+        df = pd.read_csv(file_path, dtype=RAW_DTYPES)
+    except ValueError:
+        # Text in numeric columns: columns are read as text and such values become NaN
+        df = to_numbers(pd.read_csv(file_path, dtype=TEXT_DTYPES))
+    if "created_at" in df:
+        df["created_at"] = parse_times(df["created_at"])
+    return df
+
+
+# Multithreaded parser of Arrow. Repeated strings are read as dictionaries and become categories,
+# numeric and date-time columns are converted to pandas without copy
+def read_csv_arrow(file_path):
+    import pyarrow as pa
+    from pyarrow import csv
+
+    text = pa.dictionary(pa.int32(), pa.string())
+    column_types = {
+        "created_at": pa.timestamp("ns"),
+        "user_id": text,
+        "order_type": text,
+        "order_id": pa.string(),
+        "isin": text,
+        "quantity": pa.float64(),
+        "unit_price": pa.float64(),
+    }
+    table = csv.read_csv(
+        file_path,
+        read_options=csv.ReadOptions(use_threads=True),
+        convert_options=csv.ConvertOptions(
+            column_types=column_types,
+            timestamp_parsers=[TIME_FORMAT, csv.ISO8601],
+            strings_can_be_null=True,
+        ),
+    )
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    # Categories in the same order as pandas parser gives (sorted), not in order of appearance
+    for col in ["user_id", "isin"]:
+        if col in df:
+            df[col] = df[col].cat.reorder_categories(
+                df[col].cat.categories.sort_values()
+            )
+    return df
+
+
+# Parsers of CSV file for parse_csv: engine -> function, that reads file into dataframe with types of RAW_DTYPES
+PARSERS = {
+    "c": read_csv_c,
+    "pyarrow": read_csv_arrow,
+}
+
+
+# Set of hashes of order ids for all chunks of a file: list of sorted uint64 arrays (runs). New run is merged with
+# the last runs, that are not bigger, so every hash is merged O(log N) times and there are O(log N) runs to search.
+# Memory is 8 bytes per unique order id (plus temporary copy of the biggest run while it is merged).
+def add_hashes(runs, hashes):
+    run = np.unique(hashes)
+    while runs and len(runs[-1]) <= len(run):
+        run = np.union1d(runs.pop(), run)
+    runs.append(run)
+
+
+# Mask of hashes, that are in the set of runs (binary search in every run)
+def has_hashes(runs, hashes):
+    found = np.zeros(len(hashes), dtype=bool)
+    for run in runs:
+        pos = np.searchsorted(run, hashes).clip(max=len(run) - 1)
+        found |= run[pos] == hashes
+    return found
+
+
+# Check every row of dataframe with columns of the file (one vectorized check per rule). Reasons of quarantine:
+#   missing_value          - NaN in any column (also text in numeric column or not a date-time in created_at)
+#   future_created_at      - created_at after now
+#   non_positive_quantity, non_integer_quantity, non_positive_price
+#   quantity_out_of_range  - quantity doesn't fit in type of quantity in DTYPES (int32)
+#   unknown_order_type     - order_type is not BUY or SELL
+#   duplicate_order_id     - order_id was already seen: in earlier valid row of dataframe or in seen (hashes of
+#                            order_id, see add_hashes, is updated, so the same list is passed for all chunks of the file)
+# Only rows, that pass all other checks, are checked for duplicates and added to seen, so a bad row and its
+# corrected resend with the same order_id don't quarantine each other.
+# Returns (clean rows converted to DTYPES, quarantined rows with line in the file and reasons separated by ";").
+# first_line - line of the first row in the file (header is line 1).
+def validate_rows(df, seen=None, now=None, first_line=2):
+    now = pd.Timestamp.now() if now is None else now
+    quantity = df["quantity"]
+    checks = {
+        "missing_value": df.isna().any(axis=1).to_numpy(),
+        "future_created_at": (df["created_at"] > now).to_numpy(),
+        "non_positive_quantity": (quantity <= 0).to_numpy(),
+        "quantity_out_of_range": (
+            quantity > np.iinfo(DTYPES["quantity"]).max
+        ).to_numpy(),
+        "non_integer_quantity": ((quantity % 1 != 0) & quantity.notna()).to_numpy(),
+        "non_positive_price": (df["unit_price"] <= 0).to_numpy(),
+        "unknown_order_type": (
+            ~df["order_type"].isin(DTYPES["order_type"].categories)
+            & df["order_type"].notna()
+        ).to_numpy(),
+    }
+    valid = np.flatnonzero(~np.logical_or.reduce(list(checks.values())))
+    hashes = pd.util.hash_pandas_object(
+        df["order_id"].iloc[valid], index=False
+    ).to_numpy()
+    duplicate = pd.Series(hashes).duplicated().to_numpy()
+    if seen is not None:
+        duplicate |= has_hashes(seen, hashes)
+        add_hashes(seen, hashes[~duplicate])
+    checks["duplicate_order_id"] = np.zeros(len(df), dtype=bool)
+    checks["duplicate_order_id"][valid[duplicate]] = True
+    bad = np.logical_or.reduce(list(checks.values()))
+    rows = np.flatnonzero(bad)
+    quarantine = pd.DataFrame(df.iloc[rows]).astype(
+        {"user_id": "object", "order_type": "object", "isin": "object"}
+    )
+    quarantine.insert(0, "line", rows + first_line)
+    quarantine["reason"] = [
+        ";".join(reason for reason, mask in checks.items() if mask[row]) for row in rows
+    ]
+    clean = df[~bad] if len(rows) else df
+    clean = clean.astype(DTYPES).reset_index(drop=True)
+    if len(rows):
+        for col in ["user_id", "isin"]:
+            clean[col] = clean[col].cat.remove_unused_categories()
+    return clean, quarantine.reset_index(drop=True)
+
+
+# Append quarantined rows to CSV file (with header, if file is new)
+def write_quarantine(quarantine, path):
+    if len(quarantine) == 0:
+        return
+    header = not os.path.exists(path) or os.path.getsize(path) == 0
+    quarantine.to_csv(path, mode="a", header=header, index=False)
+
+
+# Fingerprint of the file: size, modification time and hash of the content.
+# If size and modification time are the same as in known fingerprint, content is not hashed again.
+def file_fingerprint(file_path, known=None):
+    stat = os.stat(file_path)
+    fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+    if known is not None and fingerprint["size"] != known["size"]:
+        fingerprint["hash"] = None
+        return fingerprint
+    if known is not None and fingerprint["mtime"] == known["mtime"]:
+        fingerprint["hash"] = known["hash"]
+        return fingerprint
+    content_hash = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            content_hash.update(block)
+    fingerprint["hash"] = content_hash.hexdigest()
+    return fingerprint
+
+
+# Version of validation of rows: is increased, when validate_rows is changed, so files are parsed again
+VALIDATION_VERSION = 3
+# Format of cached data: cache written with other column types or other validation is not used
+CACHE_VERSION = hashlib.blake2b(
+    f"{DTYPES}|{VALIDATION_VERSION}".encode(), digest_size=8
+).hexdigest()
+
+
+# Paths of the cached copy of CSV file and of its fingerprint in cache_dir
+def cache_paths(file_path, cache_dir):
+    # Files with the same name from different folders must not share the cache
+    path_hash = hashlib.blake2b(
+        os.path.abspath(file_path).encode(), digest_size=4
+    ).hexdigest()
+    name = f"{os.path.basename(file_path)}.{path_hash}"
+    return (
+        os.path.join(cache_dir, name + ".feather"),
+        os.path.join(cache_dir, name + ".json"),
+    )
+
+
+# Read validated dataframe from cache, if CSV file wasn't changed since it was cached and cache has the current
+# CACHE_VERSION. Otherwise return None.
+def read_cache(file_path, cache_dir):
+    data_path, meta_path = cache_paths(file_path, cache_dir)
+    try:
+        with open(meta_path) as f:
+            known = json.load(f)
+        fingerprint = file_fingerprint(file_path, known)
+    except (OSError, ValueError, KeyError):
+        return None
+    if known.get("version") != CACHE_VERSION:
+        return None
+    if fingerprint["hash"] != known["hash"] or not os.path.exists(data_path):
+        return None
+    # File was only touched - remember new modification time to not hash it next time
+    if fingerprint["mtime"] != known["mtime"]:
+        write_meta(meta_path, fingerprint)
+    from pyarrow import feather
+
+    # Uncompressed feather file is memory-mapped instead of read into memory
+    return feather.read_table(data_path, memory_map=True).to_pandas()
+
+
+# Write validated dataframe in columnar binary format (feather) with fingerprint of CSV file
+def write_cache(df, file_path, cache_dir):
+    from pyarrow import feather
+
+    data_path, meta_path = cache_paths(file_path, cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to temporary file and rename it, so other process never reads half-written cache
+    feather.write_feather(df, data_path + ".tmp", compression="uncompressed")
+    os.replace(data_path + ".tmp", data_path)
+    write_meta(meta_path, file_fingerprint(file_path))
+
+
+def write_meta(meta_path, fingerprint):
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump({**fingerprint, "version": CACHE_VERSION}, f)
+    os.replace(meta_path + ".tmp", meta_path)
+
 
 # Subclass of pd.DataFrame for handling transaction data
+# Public methods are measured when profiling is enabled (see instrument.py)
+@instrument.instrument_methods
 class TransactionData(pd.DataFrame):
-    # Class method to parse CSV file and create TransactionData object
+    # Attributes, that are not columns: cache of derived data (see cached)
+    _internal_names = pd.DataFrame._internal_names + ["_derived"]
+    _internal_names_set = set(_internal_names)
+
+    # Changing of columns makes cached data outdated
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.reset_cache()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.reset_cache()
+
+    # pandas calls it after changes through loc, iloc and inplace methods
+    def _clear_item_cache(self):
+        super()._clear_item_cache()
+        self.reset_cache()
+
+    def reset_cache(self):
+        self._derived = None
+
+    # Derived data (column, sort order, table) is computed by func only once and kept until data is changed.
+    # Methods read it instead of copying and sorting the whole dataset, so don't change returned objects.
+    def cached(self, key, func):
+        cache = getattr(self, "_derived", None)
+        if cache is None:
+            cache = self._derived = {}
+        if key not in cache:
+            cache[key] = func()
+        return cache[key]
+
+    # Column of the dataset or derived column from FEATURES (order_amount, date)
+    def feature(self, name):
+        if name in self.columns:
+            return self[name]
+        return self.cached(name, lambda: FEATURES[name](self).rename(name))
+
+    # Positions of rows sorted by columns
+    def sort_order(self, by):
+        return self.cached(
+            ("sort", *by),
+            lambda: self[by].reset_index(drop=True).sort_values(by=by).index.to_numpy(),
+        )
+
+    # Table with rows (boolean mask or positions, all rows if None) and columns, columns can be derived features
+    def select(self, rows, columns):
+        if rows is None:
+            return pd.DataFrame({col: self.feature(col) for col in columns})
+        rows = np.asarray(rows)
+        return pd.DataFrame({col: self.feature(col).iloc[rows] for col in columns})
+
+    # Index of users: dict {user_id: positions of rows of the user}, computed once for all users
+    def user_index(self):
+        return self.cached(
+            "user_index",
+            lambda: self["user_id"].groupby(self["user_id"], observed=True).indices,
+        )
+
+    # Positions of rows of one user, without scanning the whole dataset
+    def user_rows(self, user):
+        return self.user_index().get(user, np.array([], dtype="int64"))
+
+    # Class method to parse CSV file and create TransactionData object.
+    # With cache_dir validated data is saved there in binary format and next time read from it,
+    # until CSV file is changed. engine - parser from PARSERS ("c" or multithreaded "pyarrow").
+    # Every row is validated (see validate_rows): bad rows are not rejected with the whole file, but removed
+    # and saved in CSV file quarantine (if given) with reasons, other rows are used.
+    # With quarantine the file is always parsed, because cache has only clean rows.
     @classmethod
-    def parse_csv(cls, file_path):
+    def parse_csv(cls, file_path, cache_dir=None, engine="c", quarantine=None):
+        if engine not in PARSERS:
+            raise ValueError(f"engine must be one of {list(PARSERS)}")
+        if cache_dir is not None and quarantine is None:
+            df = read_cache(file_path, cache_dir)
+            if df is not None:
+                print("DransactionData object was created successfully.")
+                return cls(df)
         try:
-            df = pd.read_csv(file_path, parse_dates=["created_at"])
+            try:
+                df = PARSERS[engine](file_path)
+            except ValueError:
+                # Arrow can't convert some values, pandas parser turns them into NaN
+                df = read_csv_c(file_path)
         except:
             print("File not found.")
             return None
         else:
-            # Check if it contains NaN values
-            if df.isna().any().any():
-                print("DataFrame contains NaN values.")
-                return None
-
-            # Define the set of expected column names
-            set_col = set(
-                [
-                    "user_id",
-                    "created_at",
-                    "order_type",
-                    "order_id",
-                    "isin",
-                    "quantity",
-                    "unit_price",
-                ]
-            )
             # Extract the set of column names from the DataFrame
             set_col_file = set(df.columns)
             # Check if the columns match the expected set of column names
-            if set_col == set_col_file:
+            if COLUMNS == set_col_file:
+                # Quarantine of previous parse is removed, so the file has only bad rows of this parse
+                if quarantine is not None and os.path.exists(quarantine):
+                    os.remove(quarantine)
+                df, df_quarantine = validate_rows(df)
+                if len(df_quarantine):
+                    print(f"{len(df_quarantine)} rows are moved to quarantine.")
+                    if quarantine is not None:
+                        write_quarantine(df_quarantine, quarantine)
+                if cache_dir is not None:
+                    write_cache(df, file_path, cache_dir)
                 print("DransactionData object was created successfully.")
                 return cls(df)
             else:
                 return print("File contains unexpected columns")
 
+    # Streaming mode: generator, that reads CSV file by chunks of chunksize rows and yields TransactionData objects.
+    # Memory use of chunks depends only on chunksize, not on the size of the file. Bad rows of every chunk are removed
+    # and appended to quarantine file (if given), duplicates of order_id are found through all chunks: for that
+    # hashes of order ids are kept, which takes O(unique order ids) memory, 8 bytes per order (8 MB per million rows).
+    @classmethod
+    def parse_csv_chunks(cls, file_path, chunksize=CHUNKSIZE, quarantine=None):
+        # Read only header and check columns before reading any row
+        try:
+            header = pd.read_csv(file_path, nrows=0)
+        except:
+            print("File not found.")
+            return
+        if set(header.columns) != COLUMNS:
+            print("File contains unexpected columns")
+            return
+        if quarantine is not None and os.path.exists(quarantine):
+            os.remove(quarantine)
+        seen = []
+        # Numeric columns are read as text, so one bad value doesn't stop reading of the file in the middle
+        for i, chunk in enumerate(
+            pd.read_csv(file_path, dtype=TEXT_DTYPES, chunksize=chunksize)
+        ):
+            chunk = to_numbers(chunk)
+            chunk["created_at"] = parse_times(chunk["created_at"])
+            chunk, chunk_quarantine = validate_rows(
+                chunk, seen, first_line=i * chunksize + 2
+            )
+            if quarantine is not None:
+                write_quarantine(chunk_quarantine, quarantine)
+            yield cls(chunk)
+
+    # Streaming version of susp_order_amount: find transactions with order amount greater than max, chunk by chunk
+    @classmethod
+    def stream_susp_order_amount(cls, file_path, max, chunksize=CHUNKSIZE):
+        found = []
+        for chunk in cls.parse_csv_chunks(file_path, chunksize):
+            chunk["order_amount"] = chunk["quantity"] * chunk["unit_price"]
+            found.append(
+                chunk[chunk["order_amount"] > max][
+                    ["created_at", "user_id", "order_id", "order_amount"]
+                ]
+            )
+        if not found or sum(len(i) for i in found) == 0:
+            return "No suspicious activity:))"
+        print("Suspicious activity!")
+        return pd.concat(found)
+
+    # Streaming version of order_amount_susp. Average and deviation need the whole file, so it reads the file twice:
+    # first pass combines count, mean and sum of squared differences of every chunk, second pass filters transactions
+    @classmethod
+    def stream_order_amount_susp(cls, file_path, k, chunksize=CHUNKSIZE):
+        n, avg, m2 = 0, 0.0, 0.0
+        for chunk in cls.parse_csv_chunks(file_path, chunksize):
+            amount = chunk["quantity"] * chunk["unit_price"]
+            n_chunk, avg_chunk = len(amount), amount.mean()
+            # All rows of the chunk were moved to quarantine
+            if n_chunk == 0:
+                continue
+            m2_chunk = ((amount - avg_chunk) ** 2).sum()
+            # Combine statistics of two parts (parallel variance algorithm)
+            delta = avg_chunk - avg
+            total = n + n_chunk
+            avg += delta * n_chunk / total
+            m2 += m2_chunk + delta**2 * n * n_chunk / total
+            n = total
+        if n < 2:
+            return "No suspicious transactions deviating from the norm"
+        dev = k * (m2 / (n - 1)) ** 0.5
+        found = []
+        for chunk in cls.parse_csv_chunks(file_path, chunksize):
+            chunk["order_amount"] = chunk["quantity"] * chunk["unit_price"]
+            found.append(
+                chunk[(chunk["order_amount"] - avg) > dev][
+                    ["created_at", "user_id", "order_id", "order_amount"]
+                ]
+            )
+        df_susp = pd.concat(found)
+        if df_susp.empty:
+            return "No suspicious transactions deviating from the norm"
+        return df_susp
+
+    # Streaming version of susp_circ. Every chunk is reduced to sums per user, fund, date and order type,
+    # sums of all chunks are added together, so the same user-fund-date can be split between chunks
+    @classmethod
+    def stream_susp_circ(cls, file_path, chunksize=CHUNKSIZE):
+        parts = []
+        for chunk in cls.parse_csv_chunks(file_path, chunksize):
+            chunk["order_amount"] = chunk["quantity"] * chunk["unit_price"]
+            chunk["date"] = chunk["created_at"].dt.date
+            parts.append(
+                chunk.groupby(["user_id", "isin", "date", "order_type"], observed=True)[
+                    "order_amount"
+                ].sum()
+            )
+        if not parts:
+            return "No suspicious transactions"
+        df_aid = (
+            pd.concat(parts)
+            .groupby(level=[0, 1, 2, 3], observed=True)
+            .sum()
+            .reset_index()
+        )
+        return cls.circ_from_totals(df_aid)
+
+    # Streaming version of summary: summaries of chunks are merged into summary of the whole file
+    @classmethod
+    def stream_summary(cls, file_path, chunksize=CHUNKSIZE):
+        from summary import OrderSummary
+
+        return OrderSummary.combine(
+            OrderSummary.from_frame(chunk)
+            for chunk in cls.parse_csv_chunks(file_path, chunksize)
+        )
+
+    # Summary statistics of orders (number of orders and users, order amount, orders and turnover per day,
+    # balance per user and per fund, duplicates), computed in one pass. Summaries of several datasets are merged by +
+    def summary(self):
+        from summary import OrderSummary
+
+        return self.cached("summary", lambda: OrderSummary.from_frame(self))
+
     # Check if there exists rows with future transactions in date-time column.
     def get_future_transactions(self):
         for col in self.columns:
@@ -49,160 +682,211 @@ class TransactionData(pd.DataFrame):
                 return "No future transactions"
         return "No column with date-time type"
 
-    # Show seasonal change of total order values
-    def plot_tr_activity(self):
-        # Copy dataframe
-        df_self = self.copy()
-        # Add columns with month number and month name from date-time
-        df_self["created_at_month_num"] = df_self["created_at"].dt.month
-        df_self["created_at_month_str"] = df_self["created_at"].dt.strftime("%B")
+    # Show seasonal change of total order values. With window average and deviation range of every month
+    # are taken from previous window months instead of the whole history.
+    def plot_tr_activity(self, draw=True, window=None):
+        # Month number and month name from date-time
+        month_num = self["created_at"].dt.month.rename("created_at_month_num")
+        month_str = self["created_at"].dt.strftime("%B").rename("created_at_month_str")
         # Group by number of orders
         df_self = (
-            df_self.groupby(["created_at_month_num", "created_at_month_str"])[
-                "order_id"
-            ]
+            self["order_id"]
+            .groupby([month_num, month_str])
             .count()
             .reset_index(name="orders")
         )
-        # Deviation
-        susp_dev = df_self["orders"].std()
-        # Average number of orders
-        df_self["avg"] = df_self["orders"].mean()
+        if window is None:
+            # Deviation
+            susp_dev = df_self["orders"].std()
+            # Average number of orders
+            df_self["avg"] = df_self["orders"].mean()
+        else:
+            previous = df_self["orders"].shift(1).rolling(window, min_periods=2)
+            susp_dev = previous.std()
+            df_self["avg"] = previous.mean()
         # Deviation range
         df_self["dev_max"] = df_self["avg"] + susp_dev
         df_self["dev_min"] = df_self["avg"] - susp_dev
-        # Draw
-        plt.xlabel("Month")
-        plt.ylabel("Number of orders")
-        plt.title("Seasonal Change of transaction activity")
-        plt.plot(
-            df_self["created_at_month_str"],
-            df_self["avg"],
-            color="red",
-            label="Average activity",
-        )
-        plt.plot(
-            df_self["created_at_month_str"],
-            df_self["dev_max"],
-            color="yellow",
-            label="Deviation range",
-        )
-        plt.plot(df_self["created_at_month_str"], df_self["dev_min"], color="yellow")
-        plt.bar(df_self["created_at_month_str"], df_self["orders"])
-        plt.xticks(df_self["created_at_month_str"], rotation=90)
-        plt.legend()
-        return plt.show()
+        return self.show_plot("tr_activity", df_self, draw)
 
     # Find all transactions with order amount greater than max
     def susp_order_amount(self, max):
-        df_self = self.copy()
-        susp_order = df_self["order_amount"] > max
+        susp_order = self.feature("order_amount") > max
         # Check if suspicious transactions exist
         if susp_order.any():
             print("Suspicious activity!")
-            return df_self[susp_order][
-                ["created_at", "user_id", "order_id", "order_amount"]
-            ]
+            return self.select(
+                susp_order, ["created_at", "user_id", "order_id", "order_amount"]
+            )
         else:
             return "No suspicious activity:))"
 
-    # function that helps to prepare df for frequency analysys
-    def make_df(df_set):
-        df_self = df_set.copy()
+    # Downtime engine, that prepares df for frequency analysys: transactions sorted by user and time with
+    # downtime - time in minutes between current transaction and previous transaction of the same user.
+    # It's computed once for the dataset and shared by get_hf_transactions, activity_increase_susp
+    # and plot_activity_increase_user, so don't change returned df.
+    def make_df(self):
+        return self.cached("downtimes", self._make_downtimes)
+
+    def _make_downtimes(self):
         # Sort transactions by time and user to find suspicious high of frequency among the same user
-        df_self = df_self.sort_values(by=["user_id", "created_at"]).reset_index()
-        # Time difference (downtime) - time between current transaction and previuos in minutes
-        df_self["time_diff"] = (
-            df_self["created_at"] - df_self["created_at"].shift(1)
-        ).dt.total_seconds() / 60
-        # assign 0 to negative and NaN values
-        df_self["time_diff"] = df_self["time_diff"].clip(lower=0).fillna(0)
+        order = self.sort_order(["user_id", "created_at"])
+        df_self = self.take(order).reset_index()
+        if "order_amount" not in df_self:
+            df_self["order_amount"] = self.feature("order_amount").to_numpy()[order]
+        # Time difference with previous row in minutes
+        time_diff = df_self["created_at"].diff().dt.total_seconds() / 60
+        # First transaction of each user has no previous transaction: previous row belongs to other user
+        user_codes = pd.factorize(df_self["user_id"])[0]
+        first = np.diff(user_codes, prepend=-1) != 0
+        # assign 0 to first transactions, negative and NaN values
+        df_self["time_diff"] = time_diff.mask(first, 0).clip(lower=0).fillna(0)
         return df_self
 
+    # Downtime between each transaction and previous transaction of any user, sorted by time.
+    # Shared by plot_activity_increase and plot_dev_factor_act_increase.
+    def global_downtimes(self):
+        return self.cached("global_downtimes", self._make_global_downtimes)
+
+    def _make_global_downtimes(self):
+        created_at = (
+            self["created_at"]
+            .iloc[self.sort_order(["created_at"])]
+            .reset_index(drop=True)
+        )
+        time_diff = created_at.diff().dt.total_seconds() / 60
+        # assign 0 to negative and NaN values
+        return pd.DataFrame(
+            {"created_at": created_at, "time_diff": time_diff.clip(lower=0).fillna(0)}
+        )
+
     # Check if there are transactions, between which downtime is less than threshold - high frequency of transactions
     def get_hf_transactions(self, min_freq):
         df_self = self.make_df()
         # Suspicious current transaction - if it happened in short time, less then min_freq,  after previous transaction
-        susp_next = df_self[
-            (df_self["time_diff"] > 0) & (df_self["time_diff"] < min_freq)
-        ]
-        # We should remember previous transaction too to inspect it
-        susp_prev = df_self.loc[susp_next.index - 1]
-        susp_all = pd.concat([susp_prev, susp_next]).sort_values(
-            by=["user_id", "created_at"]
-        )
+        susp_next = hf_links(df_self["time_diff"].to_numpy(), min_freq)
+        # We should remember previous transaction too to inspect it. Every transaction is taken once,
+        # even if it is both previous and next for suspicious downtimes
+        susp_prev = np.append(susp_next[1:], False)
+        susp_all = df_self[susp_next | susp_prev]
         return susp_all[["user_id", "created_at", "order_id", "order_amount"]]
 
+    # Episodes of high frequency for every threshold in min_freqs (minutes): series of transactions of the user,
+    # where every downtime is less than threshold. Transactions are sorted once (make_df), every downtime is compared
+    # with all thresholds by one binary search, and episodes of each threshold are borders of runs of short downtimes.
+    # Returns table with threshold, user, start, end, number of orders and their order_ids.
+    def hf_episodes(self, min_freqs=(1, 5, 30, 180)):
+        df_self = self.make_df()
+        time_diff = df_self["time_diff"].to_numpy()
+        min_freqs = np.sort(np.asarray(min_freqs, dtype="float64"))
+        # Index of the smallest threshold, that the downtime is less than
+        level = np.searchsorted(min_freqs, time_diff, side="right")
+        created_at = df_self["created_at"].to_numpy()
+        order_id = df_self["order_id"].to_numpy()
+        episodes = []
+        for i, min_freq in enumerate(min_freqs):
+            link = (time_diff > 0) & (level <= i)
+            # Episode starts at transaction before the first short downtime and ends at the last short downtime
+            before = np.append(False, link[:-1])
+            after = np.append(link[1:], False)
+            start = np.flatnonzero(link & ~before) - 1
+            end = np.flatnonzero(link & ~after)
+            counts = end - start + 1
+            rows = np.repeat(start - np.cumsum(counts) + counts, counts) + np.arange(
+                counts.sum()
+            )
+            episodes.append(
+                pd.DataFrame(
+                    {
+                        "min_freq": min_freq,
+                        "user_id": df_self["user_id"].to_numpy()[start],
+                        "start": created_at[start],
+                        "end": created_at[end],
+                        "orders": counts,
+                        "order_ids": (
+                            [
+                                list(ids)
+                                for ids in np.split(
+                                    order_id[rows], np.cumsum(counts)[:-1]
+                                )
+                            ]
+                            if len(counts)
+                            else []
+                        ),
+                    }
+                )
+            )
+        df_episodes = pd.concat(episodes, ignore_index=True)
+        if df_episodes.empty:
+            return "No suspicious activity:))"
+        return df_episodes
+
+    # Velocity: number of orders and their total order amount in time window (e.g. "30min") before every order,
+    # among orders of the same user (by="user_id") or of the same fund (by="isin"). Table is sorted by by and time.
+    def window_counts(self, window="30min", by="user_id"):
+        order = self.sort_order([by, "created_at"])
+        df_self = self.select(order, [by, "created_at", "order_id", "order_amount"])
+        keys = pd.factorize(df_self[by])[0].astype("int64")
+        times = df_self["created_at"].to_numpy().astype("int64")
+        counts, sums = window_totals(
+            keys,
+            times,
+            df_self["order_amount"].to_numpy(),
+            pd.Timedelta(window).value,
+        )
+        df_self["window_orders"] = counts
+        df_self["window_amount"] = sums
+        return df_self
+
+    # Orders, after which user (or fund) has more than max_orders orders or more than max_amount
+    # total order amount within window
+    def velocity_susp(
+        self, window="30min", max_orders=None, max_amount=None, by="user_id"
+    ):
+        if max_orders is None and max_amount is None:
+            raise ValueError("max_orders or max_amount must be given")
+        df_self = self.window_counts(window, by)
+        susp = np.zeros(len(df_self), dtype=bool)
+        if max_orders is not None:
+            susp |= (df_self["window_orders"] > max_orders).to_numpy()
+        if max_amount is not None:
+            susp |= (df_self["window_amount"] > max_amount).to_numpy()
+        if not susp.any():
+            return "No suspicious activity:))"
+        print("Suspicious activity!")
+        return df_self[susp]
+
     # Turnover of the fund with isin.
-    def plot_fund_turnover(self, isin):
-        df_self = self.copy()
-        # Sorting values by date
-        df_self = df_self.sort_values(by=["created_at"]).reset_index()
+    def plot_fund_turnover(self, isin, draw=True):
+        # Positions of transactions sorted by date
+        order = self.sort_order(["created_at"])
         # filter only fund isin
-        df_self = df_self[df_self["isin"] == isin]
-        # draw
-        plt.figure(figsize=(15, 6))
-        plt.xlabel("Date")
-        plt.ylabel(f"Turnover")
-        plt.title(f"Turnover of the fund {isin}")
-        plt.bar(df_self["date"], df_self["order_amount"], color="m")
-        return plt.show()
+        order = order[(self["isin"] == isin).to_numpy()[order]]
+        df_self = self.select(order, ["date", "order_amount"])
+        return self.show_plot("fund_turnover", df_self, draw, isin=isin)
 
     # Downtime of each transaction depending of time
-    def plot_activity_increase(self, k):
-        df_self = self.copy()
-        # Sort transactions by time and user to find suspicious high of frequency among the same user
-        df_self = df_self.sort_values(by=["created_at"]).reset_index()
+    def plot_activity_increase(self, k, draw=True):
         # Time difference (downtime) - time between current transaction and previuos in minutes
-        df_self["time_diff"] = (
-            df_self["created_at"] - df_self["created_at"].shift(1)
-        ).dt.total_seconds() / 60
-        # assign 0 to negative and NaN values
-        df_self["time_diff"] = df_self["time_diff"].clip(lower=0).fillna(0)
+        df_self = self.global_downtimes()
         df_self = df_self[df_self["time_diff"] > 0]
         # Average downtime
         avg = df_self["time_diff"].mean()
         # Deviation in downtime
         dev = k * df_self["time_diff"].std()
-        df_self["avg"] = avg
+        df_self = df_self.assign(avg=avg)
         # Define deviation range
         df_self["dev_max"] = df_self["avg"] + dev
         df_self["dev_min"] = (df_self["avg"] - dev).clip(lower=0)
-        # Draw
-        plt.figure(figsize=(15, 6))
-        plt.xlabel("Date")
-        plt.ylabel("Downtime")
-        plt.title("Transaction frequency")
-        plt.plot(
-            df_self["created_at"],
-            df_self["avg"],
-            color="red",
-            label="Average frequency",
-        )
-        plt.plot(
-            df_self["created_at"],
-            df_self["dev_max"],
-            color="yellow",
-            label="Deviation range",
-        )
-        plt.plot(df_self["created_at"], df_self["dev_min"], color="yellow")
-        plt.bar(df_self["created_at"], df_self["time_diff"])
-        plt.legend()
-        return plt.show()
+        return self.show_plot("activity_increase", df_self, draw)
 
     # Find all transactions, that have downtime less than k times deviation from average.
     def activity_increase_susp(self, k):
         df_self = self.make_df()
-        # delete first transaction with 0 downtime
-        df_sorted = df_self[df_self["time_diff"] > 0]
-        # Average downtime
-        avg = df_sorted["time_diff"].mean()
-        # Deviation in downtime
-        dev = k * df_sorted["time_diff"].std()
-        # Suspicious current transaction - if it happened in short time, less then min_freq,  after previous transaction
-        susp_next = df_self[
-            (df_self["time_diff"] > 0) & (df_self["time_diff"] < (avg - dev))
-        ]
+        # Suspicious current transaction - if it happened in short time (k deviations below average downtime,
+        # first transaction of the user with 0 downtime is skipped) after previous transaction
+        susp, _ = low_downtimes(df_self["time_diff"].to_numpy(), k)
+        susp_next = df_self[susp]
         # We should remember previous transaction too to inspect it
         susp_prev = df_self.loc[susp_next.index - 1]
         susp_all = pd.concat([susp_prev, susp_next]).sort_values(
@@ -212,130 +896,145 @@ class TransactionData(pd.DataFrame):
             return "No suspicious increase of activity."
         return susp_all
 
+    # The same as activity_increase_susp, but downtime of every transaction is compared with recent downtimes
+    # of the same user: average and deviation over previous window of time (or exponentially weighted with
+    # halflife in orders, see rolling_stats). With since only transactions from this time are checked and only
+    # history of one window before it is used, so checking new day of data is cheap.
+    def rolling_activity_increase_susp(
+        self, k, window="30D", halflife=None, since=None
+    ):
+        df_self = self.make_df()
+        if since is not None:
+            df_self = df_self[
+                df_self["created_at"] >= pd.Timestamp(since) - pd.Timedelta(window)
+            ]
+        # First transactions of users have no downtime
+        time_diff = df_self["time_diff"].where(df_self["time_diff"] > 0)
+        avg, dev = rolling_stats(
+            df_self["user_id"], df_self["created_at"], time_diff, window, halflife
+        )
+        susp = (time_diff < avg - k * dev).to_numpy()
+        if since is not None:
+            susp &= (df_self["created_at"] >= pd.Timestamp(since)).to_numpy()
+        if not susp.any():
+            return "No suspicious increase of activity."
+        df_susp = df_self[susp][
+            ["user_id", "created_at", "order_id", "order_amount", "time_diff"]
+        ]
+        df_susp["baseline"] = avg[susp]
+        df_susp["zscore"] = (df_susp["time_diff"] - avg[susp]) / dev[susp]
+        return df_susp
+
     # Dependence of the number of suspicious transactions on the deviation factor
-    def plot_dev_factor_act_increase(self):
-        # Do the same: sort by date, calculate downtime (time difference between current and previous transaction), change all Nan on 0, take only positive downtimes
-        df_self = self.copy()
-        df_self = df_self.sort_values(by=["created_at"]).reset_index()
-        df_self["time_diff"] = (
-            df_self["created_at"] - df_self["created_at"].shift(1)
-        ).dt.total_seconds() / 60
-        df_self["time_diff"] = df_self["time_diff"].fillna(0)
-        df_sorted = df_self[df_self["time_diff"] > 0]
-        # Average time difference (downtime)
-        avg = df_sorted["time_diff"].mean()
-        factors = [i * 0.001 for i in range(1000)]
-        effect = []
-        # For factors from 0 to 1 check, how much suspicious transactions we have in %. Save in the list 'effect'
-        for i in factors:
-            susp_dev = df_sorted["time_diff"].std()
-            df_susp = df_sorted[(df_sorted["time_diff"] - avg) < 0 - i * susp_dev]
-            effect.append(len(df_susp) * 100 / len(self))
-        # make df from two lists.
+    def plot_dev_factor_act_increase(self, draw=True):
+        # For factors from 0 to 1 check, how much suspicious transactions we have in %
+        factors, effect = self.dev_factor_act_increase()
+        # make df from two arrays.
         df_factor = pd.DataFrame({"factor": factors, "effect": effect})
-        # Draw
-        plt.figure(figsize=(15, 6))
-        plt.xlabel("factor")
-        plt.ylabel("%% of suspicious decrease of downtime")
-        plt.title("Dependence the suspicious activity increase on deviation factor")
-        plt.plot(df_factor["factor"], df_factor["effect"], color="green")
-        return plt.show()
+        return self.show_plot("dev_factor_act_increase", df_factor, draw)
+
+    # % of transactions with suspicious decrease of downtime for every factor (default from 0 to 1 with step 0.001).
+    # Downtime is the same as in plot_activity_increase: take only positive downtimes
+    def dev_factor_act_increase(self, factors=None):
+        if factors is None:
+            factors = np.arange(1000) * 0.001
+        df_self = self.global_downtimes()
+        time_diff = df_self["time_diff"][df_self["time_diff"] > 0]
+        return dev_factor_sweep(time_diff, factors, len(self), side="below")
 
     # Dependence of total order amount on time
-    def plot_order_amount(self, k):
-        dset = self.copy()
+    def plot_order_amount(self, k, draw=True):
+        dset = self.select(None, ["created_at", "order_amount"])
         # Find average and deviation range in order amount
         avg = dset["order_amount"].mean()
         dev = k * dset["order_amount"].std()
         dset["avg"] = avg
         dset["dev_max"] = dset["avg"] + dev
         dset["dev_min"] = (dset["avg"] - dev).clip(lower=0)
-        # Draw
-        plt.figure(figsize=(15, 6))
-        plt.xlabel("Date")
-        plt.ylabel("Total order amount")
-        plt.title("Change of total order amount")
-        plt.bar(dset["created_at"], dset["order_amount"])
-        plt.plot(
-            dset["created_at"], dset["avg"], color="red", label="Average order amount"
-        )
-        plt.plot(
-            dset["created_at"], dset["dev_max"], color="yellow", label="Deviation range"
-        )
-        plt.plot(dset["created_at"], dset["dev_min"], color="yellow")
-        plt.legend()
-        return plt.show()
+        return self.show_plot("order_amount", dset, draw)
 
     # Find transactions with suspiciously big order amount
     def order_amount_susp(self, k):
-        df_self = self.copy()
-        # Average and deviation
-        avg = df_self["order_amount"].mean()
-        dev = k * df_self["order_amount"].std()
+        amount = self.feature("order_amount")
         # Find transactions only with order amount higher than maximum of deviation range
-        df_susp = df_self[(self["order_amount"] - avg) > dev]
+        susp, _ = high_deviation(amount.to_numpy(), amount.mean(), amount.std(), k)
+        df_susp = self.select(
+            susp, ["created_at", "user_id", "order_id", "order_amount"]
+        )
         if df_susp.empty:
             return "No suspicious transactions deviating from the norm"
-        return df_susp[["created_at", "user_id", "order_id", "order_amount"]]
+        return df_susp
+
+    # The same as order_amount_susp, but order amount is compared with recent orders: average and deviation
+    # over previous window of time for every group of by ("user_id", "isin" or None - all orders), or
+    # exponentially weighted with halflife in orders (see rolling_stats). With since only orders from this time
+    # are checked and only history of one window before it is used, so checking new day of data is cheap.
+    # Returns suspicious orders with baseline (recent average) and zscore.
+    def rolling_order_amount_susp(
+        self, k, window="30D", by="user_id", halflife=None, since=None
+    ):
+        rows = np.arange(len(self))
+        if since is not None:
+            start = pd.Timestamp(since) - pd.Timedelta(window)
+            rows = np.flatnonzero((self["created_at"] >= start).to_numpy())
+        df_self = self.select(
+            rows, ["created_at", "user_id", "order_id", "order_amount"]
+        )
+        keys = 0 if by is None else self[by].iloc[rows].to_numpy()
+        df_self["key"] = keys
+        df_self = df_self.sort_values(by=["key", "created_at"], kind="stable")
+        avg, dev = rolling_stats(
+            df_self["key"],
+            df_self["created_at"],
+            df_self["order_amount"],
+            window,
+            halflife,
+        )
+        susp = (df_self["order_amount"] - avg > k * dev).to_numpy()
+        if since is not None:
+            susp &= (df_self["created_at"] >= pd.Timestamp(since)).to_numpy()
+        if not susp.any():
+            return "No suspicious transactions deviating from the norm"
+        df_susp = df_self[susp].drop(columns=["key"])
+        df_susp["baseline"] = avg[susp]
+        df_susp["zscore"] = (df_susp["order_amount"] - avg[susp]) / dev[susp]
+        return df_susp.sort_index()
+
+    # % of transactions with suspicious order amount for every factor (default from 0 to 4 with step 0.01)
+    def dev_factor_order_amount(self, factors=None):
+        if factors is None:
+            factors = np.arange(400) * 0.01
+        return dev_factor_sweep(
+            self.feature("order_amount"), factors, len(self), side="above"
+        )
 
     # # Dependence of the number of suspicious transactions on the deviation factor
-    def plot_dev_factor_order_amount(self):
-        df_self = self.copy()
-        avg = df_self["order_amount"].mean()
-        factors = [i * 0.01 for i in range(400)]
-        effect = []
-        # For factors from 0.01 to 4 check, how much suspicious transactions we have in %. Save in the list 'effect'
-        for i in factors:
-            dev = df_self["order_amount"].std()
-            df_susp = df_self[(df_self["order_amount"] - avg) > i * dev]
-            effect.append(len(df_susp) * 100 / len(self))
+    def plot_dev_factor_order_amount(self, draw=True):
+        # For factors from 0.01 to 4 check, how much suspicious transactions we have in %
+        factors, effect = self.dev_factor_order_amount()
         df_factor = pd.DataFrame({"factor": factors, "effect": effect})
-        # Draw
-        plt.figure(figsize=(15, 6))
-        plt.xlabel("factor")
-        plt.ylabel("%% of suspicious orders")
-        plt.title("Dependence the suspicious order amount on deviation factor")
-        plt.plot(df_factor["factor"], df_factor["effect"], color="green")
-        return plt.show()
+        return self.show_plot("dev_factor_order_amount", df_factor, draw)
 
     # For one user find his dependence of order amount on time
-    def plot_user_order_amount(self, user, k):
-        df_self = self.copy()
+    def plot_user_order_amount(self, user, k, draw=True):
         # Filter only one user
-        df_user = df_self[df_self["user_id"] == user].reset_index()
+        df_user = self.select(
+            self.user_rows(user), ["created_at", "order_amount"]
+        ).reset_index()
         # Find average order amount and deviation range
         avg = df_user["order_amount"].mean()
         dev = k * df_user["order_amount"].std()
         df_user["avg"] = avg
         df_user["dev_max"] = df_user["avg"] + dev
         df_user["dev_min"] = (df_user["avg"] - dev).clip(lower=0)
-        # Draw
-        plt.figure(figsize=(15, 6))
-        plt.xlabel("Date")
-        plt.ylabel("Order amount")
-        plt.title(f"User {user} with his total order amount pattern")
-        plt.plot(
-            df_user["created_at"],
-            df_user["avg"],
-            color="red",
-            label="Average order amount",
-        )
-        plt.plot(
-            df_user["created_at"],
-            df_user["dev_max"],
-            color="yellow",
-            label="Deviation range",
-        )
-        plt.plot(df_user["created_at"], df_user["dev_min"], color="yellow")
-        plt.bar(df_user["created_at"], df_user["order_amount"], bottom=0)
-        plt.legend()
-        return plt.show()
+        return self.show_plot("user_order_amount", df_user, draw, user=user)
 
     # For definit user find suspicious transactions based on order amount
     def user_order_amount_susp(self, user, k):
-        df_self = self.copy()
         # Filter our user
-        df_user = df_self[df_self["user_id"] == user]
+        df_user = self.select(
+            self.user_rows(user), ["created_at", "order_id", "order_amount"]
+        )
         avg = df_user["order_amount"].mean()
         dev = k * df_user["order_amount"].std()
         df_susp = df_user[(df_user["order_amount"] - avg) > dev]
@@ -343,67 +1042,228 @@ class TransactionData(pd.DataFrame):
             return f"No suspicious transactions deviating from the norm for user {user}"
         return df_susp[["created_at", "order_id", "order_amount"]]
 
+    # The same as user_order_amount_susp, but for all users in one pass: average and deviation of every user
+    # are found by one groupby. Returns suspicious orders of all users with zscore - number of user's
+    # deviations between order amount and user's average.
+    def users_order_amount_susp(self, k):
+        amount = self.feature("order_amount").to_numpy()
+        avg, dev = group_stats(pd.factorize(self["user_id"])[0], amount)
+        susp, zscore = high_deviation(amount, avg, dev, k)
+        df_susp = self.select(
+            susp, ["created_at", "user_id", "order_id", "order_amount"]
+        )
+        if df_susp.empty:
+            return "No suspicious transactions deviating from the norm"
+        df_susp["zscore"] = zscore[susp]
+        return df_susp.sort_values(by=["user_id", "created_at"], kind="stable")
+
     # find transactions, that for the same user, for the same fund on the same date has two types: BUY and SELL.
     def susp_circ(self):
-        df_copy = self.copy()
-        # take date from datetime column
-        df_copy["date"] = df_copy["created_at"].dt.date
-        # Group by date, isin and user and count number of different order_types. If it's only 1 - not suspicious, if 2 (BUY and SELL), we need to check further
-        df_gr_by_user = (
-            df_copy.groupby(["user_id", "isin", "date"])["order_type"]
-            .nunique()
+        # Orders of user, fund and date (from datetime column), that has both BUY and SELL
+        susp = both_sides(
+            group_codes(self["user_id"], self["isin"], self.feature("date")),
+            (self["order_type"] == "BUY").to_numpy(),
+        )
+        if not susp.any():
+            return "No suspicious transactions"
+        # Total order amount of these orders for every user, fund, date and order type
+        keys = [self["user_id"], self["isin"], self.feature("date"), self["order_type"]]
+        return (
+            self.feature("order_amount")[susp]
+            .groupby([key[susp] for key in keys], observed=True)
+            .sum()
             .reset_index()
         )
-        df_susp = df_gr_by_user[df_gr_by_user["order_type"] > 1]
-        if df_susp.empty:
+
+    # Circular trading in time window: pairs of BUY and SELL orders of the same user and fund,
+    # that happened not more than window apart (also through midnight). net_amount = buy_amount - sell_amount
+    def circ_pairs(self, window="1D"):
+        window = pd.Timedelta(window).value
+        keys = group_codes(self["user_id"], self["isin"])
+        times = self["created_at"].to_numpy().astype("int64")
+        is_buy = (self["order_type"] == "BUY").to_numpy()
+        buy = np.flatnonzero(is_buy)
+        sell = np.flatnonzero(~is_buy)
+        buy_pos, sell_pos = window_pairs(
+            keys[buy], times[buy], keys[sell], times[sell], window
+        )
+        buy, sell = buy[buy_pos], sell[sell_pos]
+        if len(buy) == 0:
             return "No suspicious transactions"
-        else:
-            # Make beautiful table for transactions on the same date, isin and user, but with different order types.
-            df_aid = (
-                df_copy.groupby(["user_id", "isin", "date", "order_type"])[
-                    "order_amount"
-                ]
-                .sum()
-                .reset_index()
+        amount = self.feature("order_amount").to_numpy()
+        created_at = self["created_at"].to_numpy()
+        order_id = self["order_id"].to_numpy()
+        df_pairs = pd.DataFrame(
+            {
+                "user_id": self["user_id"].iloc[buy].to_numpy(),
+                "isin": self["isin"].iloc[buy].to_numpy(),
+                "buy_order_id": order_id[buy],
+                "sell_order_id": order_id[sell],
+                "buy_created_at": created_at[buy],
+                "sell_created_at": created_at[sell],
+                "buy_amount": amount[buy],
+                "sell_amount": amount[sell],
+            }
+        )
+        df_pairs["net_amount"] = df_pairs["buy_amount"] - df_pairs["sell_amount"]
+        return df_pairs.sort_values(
+            by=["user_id", "isin", "buy_created_at", "sell_created_at"]
+        ).reset_index(drop=True)
+
+    # Cross-user wash trades: SELL of one user and BUY of another user of the same fund within window, with
+    # quantity differing not more than qty_tol and unit price not more than price_tol (fraction of SELL price).
+    # Candidates are found by window_pairs over fund and time (sorted join instead of merge of all orders
+    # of the fund), then filtered by users, quantity and price. Returns positions of matched (sell, buy) orders.
+    def wash_matches(self, window="10min", qty_tol=0, price_tol=0.005):
+        window = pd.Timedelta(window).value
+        keys = group_codes(self["isin"])
+        times = self["created_at"].to_numpy().astype("int64")
+        is_sell = (self["order_type"] == "SELL").to_numpy()
+        sell = np.flatnonzero(is_sell)
+        buy = np.flatnonzero(~is_sell)
+        sell_pos, buy_pos = window_pairs(
+            keys[sell], times[sell], keys[buy], times[buy], window
+        )
+        sell, buy = sell[sell_pos], buy[buy_pos]
+        user_id = group_codes(self["user_id"])
+        quantity = self["quantity"].to_numpy()
+        unit_price = self["unit_price"].to_numpy()
+        match = (
+            (user_id[sell] != user_id[buy])
+            & (np.abs(quantity[sell] - quantity[buy]) <= qty_tol)
+            & (
+                np.abs(unit_price[sell] - unit_price[buy])
+                <= price_tol * unit_price[sell]
+            )
+        )
+        return sell[match], buy[match]
+
+    # Table of pairs of orders of wash_matches
+    def wash_pairs(self, window="10min", qty_tol=0, price_tol=0.005):
+        sell, buy = self.wash_matches(window, qty_tol, price_tol)
+        if len(sell) == 0:
+            return "No suspicious transactions"
+        amount = self.feature("order_amount").to_numpy()
+        created_at = self["created_at"].to_numpy()
+        order_id = self["order_id"].to_numpy()
+        df_pairs = pd.DataFrame(
+            {
+                "isin": self["isin"].iloc[sell].to_numpy(),
+                "sell_user_id": self["user_id"].iloc[sell].to_numpy(),
+                "buy_user_id": self["user_id"].iloc[buy].to_numpy(),
+                "sell_order_id": order_id[sell],
+                "buy_order_id": order_id[buy],
+                "sell_created_at": created_at[sell],
+                "buy_created_at": created_at[buy],
+                "sell_amount": amount[sell],
+                "buy_amount": amount[buy],
+            }
+        )
+        return df_pairs.sort_values(
+            by=["isin", "sell_created_at", "buy_created_at"]
+        ).reset_index(drop=True)
+
+    # Graph of accounts from wash_pairs: edge from seller to buyer with number of matched pairs and their total
+    # amount as weights, sorted by number of pairs. Arguments are passed to wash_pairs.
+    def wash_graph(self, **params):
+        df_pairs = self.wash_pairs(**params)
+        if isinstance(df_pairs, str):
+            return df_pairs
+        return (
+            df_pairs.groupby(["sell_user_id", "buy_user_id"], observed=True)
+            .agg(pairs=("sell_order_id", "size"), amount=("sell_amount", "sum"))
+            .reset_index()
+            .sort_values(by=["pairs", "amount"], ascending=False, kind="stable")
+            .reset_index(drop=True)
+        )
+
+    # Parallel mode: dataset is split by hash of user_id into n_jobs parts, parts are saved in memory-mapped
+    # files and detectors run on them in separate processes. detectors - dict {name: tuple of arguments}, names
+    # from USER_DETECTORS. Results of parts are concatenated and sorted, so they are the same as results
+    # of serial run, only row labels are renumbered. Returns dict {name: result}.
+    def run_parallel(self, detectors, n_jobs=None):
+        from pyarrow import feather
+
+        for name in detectors:
+            if name not in USER_DETECTORS:
+                raise ValueError(f"Detector '{name}' can't run on parts of users")
+        if n_jobs is None:
+            n_jobs = os.cpu_count()
+        # Hash of value doesn't depend on process, unlike built-in hash of str
+        part = pd.util.hash_pandas_object(self["user_id"], index=False).to_numpy()
+        part = part % n_jobs
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = []
+            for i in range(n_jobs):
+                rows = np.flatnonzero(part == i)
+                if len(rows) == 0:
+                    continue
+                path = os.path.join(tmp_dir, f"part_{i}.feather")
+                df_part = pd.DataFrame(self.take(rows)).reset_index(names="index")
+                feather.write_feather(df_part, path, compression="uncompressed")
+                paths.append(path)
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                part_results = list(
+                    executor.map(run_partition, paths, [detectors] * len(paths))
+                )
+        results = {}
+        for name in detectors:
+            found = [r[name] for r in part_results if not isinstance(r[name], str)]
+            if not found:
+                # All parts returned message "No suspicious ..."
+                results[name] = part_results[0][name] if part_results else None
+                continue
+            results[name] = (
+                pd.concat(found)
+                .sort_values(by=USER_DETECTORS[name], kind="stable")
+                .reset_index(drop=True)
             )
-            df_susp = df_susp.rename(columns={"order_type": "types"})
-            df_susp = df_susp.merge(df_aid, on=["user_id", "isin", "date"], how="left")
-            df_susp = df_susp.drop(columns=["types"])
-            return df_susp
+        return results
+
+    # Take total order amounts per user, fund, date and order type and keep only user-fund-date with both BUY and SELL.
+    @staticmethod
+    def circ_from_totals(df_aid):
+        # Count number of different order_types. If it's only 1 - not suspicious, if 2 (BUY and SELL), we need to check further
+        types = df_aid.groupby(["user_id", "isin", "date"], observed=True)[
+            "order_type"
+        ].transform("nunique")
+        df_susp = df_aid[types > 1].reset_index(drop=True)
+        if df_susp.empty:
+            return "No suspicious transactions"
+        return df_susp
 
     # Frequency of transactions for one user
-    def plot_activity_increase_user(self, user, k):
+    def plot_activity_increase_user(self, user, k, draw=True):
         df_self = self.make_df()
         df_activ = (
             df_self[df_self["time_diff"] > 0]
-            .groupby(["user_id"])["time_diff"]
+            .groupby(["user_id"], observed=True)["time_diff"]
             .agg(["mean", "std"])
         )
         df_full = pd.merge(df_self, df_activ, on="user_id", how="left")
         df_full["dev_max"] = df_full["mean"] + k * df_full["std"]
         df_full["dev_min"] = (df_full["mean"] - k * df_full["std"]).clip(lower=0)
         df_full = df_full[df_full["user_id"] == user]
-        # Draw
-        plt.figure(figsize=(15, 6))
-        plt.xlabel("Date")
-        plt.ylabel("Downtime")
-        plt.title("Speed of user's activity")
-        plt.bar(df_full["created_at"], df_full["time_diff"], bottom=0)
-        plt.plot(
-            df_full["created_at"],
-            df_full["mean"],
-            color="red",
-            label="Average downtime",
-        )
-        plt.plot(
-            df_full["created_at"],
-            df_full["dev_max"],
-            color="yellow",
-            label="Deviation range",
-        )
-        plt.plot(df_full["created_at"], df_full["dev_min"], color="yellow")
-        plt.legend()
-        df_susp_rapid = df_full[
-            (df_full["time_diff"] < df_full["dev_min"]) & (df_full["time_diff"] > 0)
-        ]
-        return plt.show()
+        return self.show_plot("activity_increase_user", df_full, draw)
+
+    # Show computed data of plot_<name> method (if draw) and return it, so it can be used without drawing
+    def show_plot(self, name, data, draw, **params):
+        if draw:
+            import plots
+
+            plots.show(name, data, **params)
+        return data
+
+    # Report mode: save figures of plot_* methods in files (png, svg) of out_dir, figures are drawn without
+    # pyplot in parallel processes, so it works on servers without display and doesn't wait for windows.
+    # figures - list of (name, params) where name is the name of plot_<name> method and params - dict with
+    # its arguments, e.g. [("tr_activity", {}), ("fund_turnover", {"isin": "LU98163828108"})].
+    # With html also index.html with all figures is written. Returns list of paths of figures.
+    def render_report(self, figures, out_dir, fmt="png", n_jobs=None, html=True):
+        computed = []
+        for name, params in figures:
+            data = getattr(self, f"plot_{name}")(draw=False, **params)
+            computed.append((name, data, params))
+        import plots
+
+        return plots.render(computed, out_dir, fmt, n_jobs, html)